@@ -0,0 +1,279 @@
+"""Нагрузочный замер функций database.py на синтетических данных.
+
+Пример:
+    python bench_database.py --scales 1000,100000 --concurrency 1,16 --output bench.json
+    python bench_database.py --scales 1000 --compare bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import database
+from fsm_storage import SQLiteStorage
+
+# Свободные слоты для book_slot начинаются после записей и блокировок
+FREE_SLOTS_OFFSET = 3
+
+
+def slot_at(index: int, base: datetime):
+    # Сетка по 5 минут, чтобы уникальных слотов хватало на миллион строк
+    moment = base + timedelta(minutes=5 * index)
+    return moment.strftime('%Y-%m-%d'), moment.strftime('%A'), moment.strftime('%H:%M')
+
+
+def seed(path: str, rows: int, expired_share: float, free_slots: int = 0):
+    """Заполнение БД напрямую через sqlite3: половина строк в прошлом, блокировки отдельно.
+
+    free_slots свободных слотов после блокировок - под замер book_slot.
+    """
+    expired = int(rows * expired_share)
+    past_base = datetime.now() - timedelta(minutes=5 * expired + 60 * 24)
+    future_base = datetime.now() + timedelta(days=1)
+
+    def appointments():
+        for i in range(rows):
+            base, offset = (past_base, i) if i < expired else (future_base, i - expired)
+            date, day, time = slot_at(offset, base)
+            yield (i + 1, f"user{i}", f"User {i}", date, day, time, database.slot_timestamp(date, time))
+
+    def blocked():
+        # Блокировки идут сразу после записей, чтобы не пересекаться с ними
+        for i in range(rows):
+            date, _, time = slot_at(rows + i, future_base)
+            yield (date, time, "bench", 1)
+
+    db = sqlite3.connect(path)
+    db.executemany('''
+        INSERT INTO appointments (user_id, username, full_name, date, day, time, starts_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', appointments())
+    db.executemany('''
+        INSERT INTO blocked_slots (date, time, reason, blocked_by) VALUES (?, ?, ?, ?)
+    ''', blocked())
+    # Материализованный календарь: каждой записи и блокировке соответствует слот
+    db.execute('''
+        INSERT OR IGNORE INTO slots (date, time, status)
+        SELECT date, time, ? FROM appointments
+        UNION ALL
+        SELECT date, time, ? FROM blocked_slots
+    ''', (database.SLOT_BOOKED, database.SLOT_BLOCKED))
+    db.executemany('INSERT OR IGNORE INTO slots (date, time) VALUES (?, ?)', (
+        slot_at(FREE_SLOTS_OFFSET * rows + i, future_base)[::2] for i in range(free_slots)
+    ))
+    db.commit()
+    db.execute("ANALYZE")
+    db.close()
+
+
+async def measure(call, iterations: int, concurrency: int) -> dict:
+    """iterations вызовов call(i) в concurrency параллельных потоках"""
+    latencies = []
+    counter = iter(range(iterations))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            await call(i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+
+    def pct(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+
+    return {
+        "calls": len(latencies),
+        "ops_per_sec": len(latencies) / wall if wall else 0.0,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": pct(0.5),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+async def bench_scale(rows: int, concurrency_levels: list, iterations: int, workdir: str) -> list:
+    path = os.path.join(workdir, f"bench_{rows}.db")
+    database.DB_NAME = path
+    await database.init_db()
+    await database.close_db()
+
+    print(f"Заполнение {rows} строк...")
+    seed(path, rows, expired_share=0.5, free_slots=iterations * len(concurrency_levels))
+    await database.init_db()
+
+    rng = random.Random(rows)
+    future_base = datetime.now() + timedelta(days=1)
+    expired = rows // 2
+    new_user = iter(range(10 ** 9, 2 * 10 ** 9))
+    new_slot = iter(range(FREE_SLOTS_OFFSET * rows, 10 ** 9))
+
+    async def slot_check(_):
+        date, _, time = slot_at(rng.randrange(max(rows - expired, 1)), future_base)
+        await database.is_slot_available(date, time)
+
+    async def user_lookup(_):
+        await database.get_user_appointment(rng.randrange(1, rows + 1))
+
+    async def week_availability(_):
+        date, _, _ = slot_at(rng.randrange(max(rows - expired, 1)), future_base)
+        date_to = (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=6)).strftime('%Y-%m-%d')
+        await database.get_availability(date, date_to)
+
+    async def book(_):
+        date, day, time = slot_at(next(new_slot), future_base)
+        result = await database.book_slot(next(new_user), "bench", "Bench", date, day, time)
+        assert result.status == database.BookingStatus.BOOKED, result
+
+    first_future = slot_at(0, future_base)[0]
+
+    async def blocked_list(_):
+        # Страница будущих блокировок со случайной позиции
+        date, _, time = slot_at(rows + rng.randrange(rows), future_base)
+        await database.get_blocked_slots(first_future, after=(date, time))
+
+    # FSM: сценарий шага диалога (записать состояние и данные, прочитать) на разных хранилищах
+    memory_storage = MemoryStorage()
+    sqlite_storage = SQLiteStorage()
+    # Кэш на одну запись: каждое чтение - промах и запрос к SQLite
+    cold_storage = SQLiteStorage(maxsize=1)
+    fsm_users = min(rows, 10000)
+
+    def fsm_key(i):
+        user_id = i % fsm_users + 1
+        return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+    def fsm_step(storage):
+        async def step(i):
+            key = fsm_key(i)
+            await storage.set_state(key, "Booking:confirm")
+            await storage.update_data(key, {"slot": i})
+            await storage.get_state(key)
+        return step
+
+    async def fsm_cold_read(i):
+        await cold_storage.get_data(fsm_key(rng.randrange(fsm_users)))
+
+    cases = [
+        ("is_slot_available", slot_check, iterations),
+        ("get_user_appointment", user_lookup, iterations),
+        ("get_availability", week_availability, iterations),
+        ("book_slot", book, iterations),
+        ("get_blocked_slots", blocked_list, iterations),
+        ("fsm_memory_storage", fsm_step(memory_storage), iterations),
+        ("fsm_sqlite_storage", fsm_step(sqlite_storage), iterations),
+    ]
+
+    results = []
+    for name, call, count in cases:
+        for concurrency in concurrency_levels:
+            stats = await measure(call, count, concurrency)
+            results.append({"scale": rows, "function": name, "concurrency": concurrency, **stats})
+            print(f"{rows:>9} {name:<28} c={concurrency:<3} "
+                  f"p50={stats['p50_ms']:.3f}мс p99={stats['p99_ms']:.3f}мс {stats['ops_per_sec']:.0f} оп/с")
+
+    # Сброс отложенной записи и чтение с промахом кэша
+    start = time.perf_counter()
+    await sqlite_storage.close()
+    elapsed = (time.perf_counter() - start) * 1000
+    results.append({"scale": rows, "function": "fsm_sqlite_flush", "concurrency": 1,
+                    "calls": 1, "rows": min(iterations, fsm_users), "p50_ms": elapsed, "p99_ms": elapsed})
+    print(f"{rows:>9} {'fsm_sqlite_flush':<28} {min(iterations, fsm_users)} состояний за {elapsed:.1f}мс")
+    for concurrency in concurrency_levels:
+        stats = await measure(fsm_cold_read, iterations, concurrency)
+        results.append({"scale": rows, "function": "fsm_sqlite_cold_read", "concurrency": concurrency, **stats})
+        print(f"{rows:>9} {'fsm_sqlite_cold_read':<28} c={concurrency:<3} "
+              f"p50={stats['p50_ms']:.3f}мс p99={stats['p99_ms']:.3f}мс {stats['ops_per_sec']:.0f} оп/с")
+
+    # Разовые операции: очистка накопленных прошедших записей и холодный старт
+    start = time.perf_counter()
+    archived = await database.delete_expired_appointments()
+    elapsed = (time.perf_counter() - start) * 1000
+    results.append({"scale": rows, "function": "delete_expired_appointments", "concurrency": 1,
+                    "calls": 1, "rows": archived, "p50_ms": elapsed, "p99_ms": elapsed})
+    print(f"{rows:>9} {'delete_expired_appointments':<28} {archived} строк за {elapsed:.1f}мс")
+
+    await database.close_db()
+    start = time.perf_counter()
+    await database.init_db()
+    elapsed = (time.perf_counter() - start) * 1000
+    results.append({"scale": rows, "function": "init_db", "concurrency": 1,
+                    "calls": 1, "p50_ms": elapsed, "p99_ms": elapsed})
+    print(f"{rows:>9} {'init_db':<28} {elapsed:.1f}мс")
+    await database.close_db()
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {(r["scale"], r["function"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nСравнение с {baseline_path} ({baseline['meta']['revision']}), p50:")
+    for r in results:
+        before = old.get((r["scale"], r["function"], r["concurrency"]))
+        if before and before["p50_ms"]:
+            change = (r["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100
+            print(f"{r['scale']:>9} {r['function']:<28} c={r['concurrency']:<3} "
+                  f"{before['p50_ms']:.3f} -> {r['p50_ms']:.3f}мс ({change:+.0f}%)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1000,100000", help="Объёмы таблиц через запятую, например 1000,100000,1000000")
+    parser.add_argument("--concurrency", default="1,8", help="Уровни параллелизма через запятую")
+    parser.add_argument("--iterations", type=int, default=1000, help="Вызовов на каждый замер")
+    parser.add_argument("--output", default="bench_results.json", help="Файл для результатов в JSON")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    scales = [int(x) for x in args.scales.split(",")]
+    concurrency = [int(x) for x in args.concurrency.split(",")]
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in scales:
+            results += await bench_scale(rows, concurrency, args.iterations, workdir)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "iterations": args.iterations,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
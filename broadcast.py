@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest,
+    TelegramNetworkError, TelegramServerError, TelegramAPIError,
+)
+from config import BROADCAST_RATE, BROADCAST_CHAT_INTERVAL, BROADCAST_BATCH_SIZE
+from database import (
+    BROADCAST_RUNNING, BROADCAST_DONE, BROADCAST_CANCELLED,
+    create_broadcast, get_running_broadcast, get_broadcast_recipients,
+    save_broadcast_progress, prune_recipients,
+)
+from metrics import background_task
+from notifications import admin_notifier
+from ratelimit import TokenBucket, ChatThrottle
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 5
+# Ответы Telegram, после которых писать получателю бессмысленно
+GONE_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+
+class Broadcaster:
+    """Фоновая рассылка всем, кто когда-либо записывался.
+
+    Отправка идёт по одному сообщению с общим и початовым ограничением частоты,
+    после каждой пачки получателей позиция сохраняется в БД - прерванная
+    рассылка продолжается с неё при следующем запуске.
+    """
+
+    def __init__(self, rate: float = BROADCAST_RATE, chat_interval: float = BROADCAST_CHAT_INTERVAL,
+                 batch_size: int = BROADCAST_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.progress = None  # Состояние текущей рассылки
+        self._bucket = TokenBucket(rate)
+        self._chats = ChatThrottle(chat_interval)
+        self._bot = None
+        self._task = None
+        self._cancelled = False
+        # Между проверкой running и запуском задачи есть await - две команды подряд не должны обе пройти
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot: Bot):
+        self._bot = bot
+        row = await get_running_broadcast()
+        if row is not None:
+            logger.info(f"Продолжаем рассылку #{row[0]} после пользователя {row[2]}")
+            self._launch(row)
+
+    async def stop(self):
+        """Остановка при выключении бота: рассылка останется незавершённой и продолжится"""
+        if self.running:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def begin(self, text: str, admin_id: int) -> dict | None:
+        """Запуск новой рассылки; None - предыдущая ещё идёт"""
+        async with self._start_lock:
+            if self.running:
+                return None
+            self._launch(await create_broadcast(text, admin_id))
+            return self.progress
+
+    async def cancel(self) -> bool:
+        if not self.running:
+            return False
+        self._cancelled = True
+        await self.stop()
+        return True
+
+    def _launch(self, row: tuple):
+        broadcast_id, text, last_user_id, sent, failed, total = row
+        self.progress = {
+            "id": broadcast_id, "last_user_id": last_user_id,
+            "sent": sent, "failed": failed, "pruned": 0, "total": total,
+        }
+        self._cancelled = False
+        self._task = background_task(self._run(text))
+
+    async def _checkpoint(self, status: str = BROADCAST_RUNNING):
+        state = self.progress
+        await save_broadcast_progress(state["id"], state["last_user_id"], state["sent"], state["failed"], status)
+
+    async def _run(self, text: str):
+        state = self.progress
+        try:
+            while True:
+                user_ids = await get_broadcast_recipients(state["last_user_id"], self.batch_size)
+                if not user_ids:
+                    break
+                gone = []
+                for user_id in user_ids:
+                    delivered = await self._send(user_id, text)
+                    if delivered:
+                        state["sent"] += 1
+                    else:
+                        state["failed"] += 1
+                        if delivered is None:
+                            gone.append(user_id)
+                    state["last_user_id"] = user_id
+                if gone:
+                    await prune_recipients(gone)
+                    state["pruned"] += len(gone)
+                await self._checkpoint()
+        except asyncio.CancelledError:
+            await self._checkpoint(BROADCAST_CANCELLED if self._cancelled else BROADCAST_RUNNING)
+            logger.info(f"Рассылка #{state['id']} остановлена после пользователя {state['last_user_id']}")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка рассылки #{state['id']}: {e}", exc_info=True)
+            return
+
+        await self._checkpoint(BROADCAST_DONE)
+        logger.info(f"Рассылка #{state['id']} завершена: {state['sent']} из {state['total']}")
+        admin_notifier.notify(
+            f"📣 Рассылка #{state['id']} завершена:\n"
+            f"✅ Доставлено: {state['sent']}\n"
+            f"❌ Не доставлено: {state['failed']}\n"
+            f"🧹 Удалено недоступных получателей: {state['pruned']}"
+        )
+
+    async def _send(self, user_id: int, text: str) -> bool | None:
+        """True - доставлено, False - ошибка, None - получатель недоступен навсегда"""
+        for attempt in range(MAX_RETRIES):
+            await self._chats.wait(user_id)
+            await self._bucket.acquire()
+            try:
+                await self._bot.send_message(user_id, text, parse_mode=None)
+                return True
+            except TelegramRetryAfter as e:
+                # Ограничение действует на весь бот - вся рассылка ждёт
+                logger.warning(f"Ограничение Telegram в рассылке, ждём {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+            except TelegramForbiddenError:
+                return None
+            except TelegramBadRequest as e:
+                if any(error in str(e).lower() for error in GONE_ERRORS):
+                    return None
+                logger.warning(f"Рассылка: сообщение {user_id} отклонено: {e}")
+                return False
+            except (TelegramNetworkError, TelegramServerError) as e:
+                delay = min(2 ** attempt, 60)
+                logger.warning(f"Рассылка: сбой отправки ({e}), повтор через {delay} с")
+                await asyncio.sleep(delay)
+            except TelegramAPIError as e:
+                logger.warning(f"Рассылка: сообщение {user_id} не отправлено: {e}")
+                return False
+        return False
+
+
+broadcaster = Broadcaster()
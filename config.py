@@ -1,8 +1,99 @@
+import json
 import os
+from datetime import datetime
 from dotenv import load_dotenv
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_ID = int(os.getenv('ADMIN_ID', 0))  # Преобразуем в число
-TIMEZONE = 'Europe/Moscow'  # Добавляем временную зону
\ No newline at end of file
+TIMEZONE = 'Europe/Moscow'  # Добавляем временную зону
+SLOT_TIMES = ["13:00", "15:00", "17:00", "19:00"]  # Время консультаций
+
+
+def _normalize_times(times: list) -> list:
+    # '9:00' -> '09:00': иначе слот сортируется после '19:00' и не совпадает с /block 09:00.
+    # Неверный формат - ValueError при запуске
+    return sorted({datetime.strptime(time, '%H:%M').strftime('%H:%M') for time in times})
+
+
+# Недельный шаблон: день недели (0 - понедельник) -> времена, JSON вида {"0": ["13:00", "15:00"]}.
+# По умолчанию понедельник-суббота по SLOT_TIMES
+_schedule_template = os.getenv('SCHEDULE_TEMPLATE')
+SCHEDULE_TEMPLATE = (
+    {int(day): _normalize_times(times) for day, times in json.loads(_schedule_template).items()}
+    if _schedule_template else {day: SLOT_TIMES for day in range(6)}
+)
+BOOKING_HORIZON_WEEKS = int(os.getenv('BOOKING_HORIZON_WEEKS', 2))  # На сколько недель вперёд открыта запись
+
+# Пул соединений SQLite
+DB_READERS = int(os.getenv('DB_READERS', 4))  # Количество соединений на чтение
+DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', 5000))  # Ожидание блокировки, мс
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', 128))  # Кэш подготовленных запросов
+# Кэш доступности слотов
+SLOT_CACHE_TTL = int(os.getenv('SLOT_CACHE_TTL', 300))  # Время жизни записи, сек
+SLOT_CACHE_SIZE = int(os.getenv('SLOT_CACHE_SIZE', 4096))  # Максимум слотов в кэше
+EDIT_FINGERPRINT_SIZE = int(os.getenv('EDIT_FINGERPRINT_SIZE', 10000))  # Сообщений, чьё содержимое помним для пропуска повторных правок
+
+# Хранилище состояний FSM в SQLite
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', 10000))  # Состояний пользователей в памяти
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', 1))  # Период записи изменений в БД, сек
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', 24 * 3600))  # Срок жизни неизменявшегося состояния, сек
+
+# Фоновое обслуживание БД
+SWEEP_INTERVAL = int(os.getenv('SWEEP_INTERVAL', 60))  # Период очистки прошедших записей, сек
+SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', 500))  # Строк в одной транзакции
+BLOCKED_PAGE_SIZE = int(os.getenv('BLOCKED_PAGE_SIZE', 20))  # Блокировок на странице /blocked
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 500))  # Строк за одно чтение при выгрузке /export
+
+# Очередь уведомлений администратора
+NOTIFY_QUEUE_SIZE = int(os.getenv('NOTIFY_QUEUE_SIZE', 1000))  # Ёмкость очереди
+NOTIFY_DIGEST_THRESHOLD = int(os.getenv('NOTIFY_DIGEST_THRESHOLD', 5))  # Событий в окне до перехода на сводку
+NOTIFY_DIGEST_WINDOW = int(os.getenv('NOTIFY_DIGEST_WINDOW', 30))  # Окно подсчёта событий, сек
+NOTIFY_MAX_RETRIES = int(os.getenv('NOTIFY_MAX_RETRIES', 5))  # Повторов отправки при сбоях
+
+# Ограничение частоты действий одного пользователя (token bucket)
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', 2))  # Действий в секунду в среднем
+THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', 5))  # Допустимая серия подряд
+THROTTLE_EVICT_INTERVAL = int(os.getenv('THROTTLE_EVICT_INTERVAL', 60))  # Период удаления неактивных пользователей, сек
+
+# Параллельные запросы к Bot API внутри одного обработчика
+FANOUT_CONCURRENCY = int(os.getenv('FANOUT_CONCURRENCY', 4))  # Одновременных запросов
+FANOUT_TIMEOUT = float(os.getenv('FANOUT_TIMEOUT', 10))  # Предел ожидания одного запроса, сек
+
+# Напоминания клиентам о предстоящей записи
+REMINDER_LEAD = int(os.getenv('REMINDER_LEAD', 3 * 3600))  # За сколько до начала напоминать, сек
+REMINDER_WINDOW = int(os.getenv('REMINDER_WINDOW', 6 * 3600))  # Сколько вперёд держать в памяти, сек
+REMINDER_RATE = float(os.getenv('REMINDER_RATE', 20))  # Отправок в секунду, ниже общего лимита Telegram
+
+# Лист ожидания
+WAITLIST_HOLD = int(os.getenv('WAITLIST_HOLD', 120))  # Сколько слот предлагается одному ожидающему до следующего, сек
+
+# Рассылки администратора
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20))  # Сообщений в секунду; остаток лимита Telegram - обычным ответам
+BROADCAST_CHAT_INTERVAL = float(os.getenv('BROADCAST_CHAT_INTERVAL', 1))  # Интервал между сообщениями в один чат, сек
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', 100))  # Получателей между контрольными точками
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес для setWebhook; пустой - сервер только слушает (удобно для локальной проверки POST-запросами)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # Сверяется с заголовком X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+
+# Логирование: запись в файл и вывод идут в отдельном потоке через очередь
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json или text
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')  # Пустой - только вывод в консоль
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))  # Размер файла до ротации
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', 5))  # Сколько старых файлов хранить
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # При переполнении записи отбрасываются
+LOG_DEBUG_SAMPLE = float(os.getenv('LOG_DEBUG_SAMPLE', 0.01))  # Доля сохраняемых DEBUG-записей
+
+# Метрики
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))  # 0 - не запускать HTTP-выгрузку
+METRICS_WINDOW = int(os.getenv('METRICS_WINDOW', 1024))  # Последних значений для квантилей
+SLOW_UPDATE_THRESHOLD = int(os.getenv('SLOW_UPDATE_THRESHOLD', 500))  # Порог медленной обработки, мс
\ No newline at end of file
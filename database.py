@@ -1,75 +1,790 @@
+import asyncio
 import aiosqlite
-from datetime import datetime
+import sqlite3
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import NamedTuple
 import logging
+import time as clock
 import pytz
-from config import ADMIN_ID, TIMEZONE
+from metrics import timed_query
+from config import (
+    ADMIN_ID, TIMEZONE, DB_READERS, DB_BUSY_TIMEOUT, DB_STATEMENT_CACHE,
+    SWEEP_BATCH_SIZE, BLOCKED_PAGE_SIZE, EXPORT_CHUNK_SIZE,
+)
 
 logger = logging.getLogger(__name__)
 DB_NAME = 'appointments.db'
 
-async def init_db():
-    """Инициализация базы данных с автоматической миграцией"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        
-        cursor = await db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='appointments'")
-        table_exists = await cursor.fetchone()
-        
-        if not table_exists:
-            logger.info("Создание таблиц...")
-            await create_tables(db)
-            return
-        
-        cursor = await db.execute("PRAGMA table_info(appointments)")
-        columns = await cursor.fetchall()
-        column_names = {col[1] for col in columns}
-        required_columns = {'user_id', 'username', 'full_name', 'date', 'day', 'time'}
-        
-        if not required_columns.issubset(column_names):
-            logger.warning("Обнаружена устаревшая структура таблицы, выполняется миграция...")
-            await migrate_database(db)
-
-async def migrate_database(db):
+# Статусы слотов в матрице доступности
+SLOT_FREE = 'free'
+SLOT_BOOKED = 'booked'
+SLOT_BLOCKED = 'blocked'
+SLOT_HELD = 'held'  # Свободен, но придержан для ожидающего из листа; в таблице не хранится
+
+# События изменения данных для кэшей и фоновых задач
+EVENT_BOOKED = 'booked'
+EVENT_CANCELLED = 'cancelled'
+EVENT_BLOCKED = 'blocked'
+EVENT_UNBLOCKED = 'unblocked'
+EVENT_EXPIRED = 'expired'
+EVENT_SCHEDULE = 'schedule'
+EVENT_HELD = 'held'
+
+# Состояния рассылки
+BROADCAST_RUNNING = 'running'
+BROADCAST_DONE = 'done'
+BROADCAST_CANCELLED = 'cancelled'
+
+_ADD_RECIPIENT_SQL = 'INSERT OR IGNORE INTO broadcast_recipients (user_id) VALUES (?)'
+_LEAVE_WAITLIST_SQL = 'DELETE FROM waitlist WHERE user_id = ?'
+
+# Сводка daily_stats обновляется в той же транзакции, что и само изменение.
+# Записи и отмены: (date, time, +записей, +отмен, изменение занятости).
+# Слота ещё нет в сводке (запись сделана до неё) - занятость берётся из appointments
+_COUNT_BOOKING_SQL = '''
+    INSERT INTO daily_stats (date, time, bookings, cancellations, filled)
+    VALUES (?1, ?2, ?3, ?4, (SELECT COUNT(*) FROM appointments WHERE date = ?1 AND time = ?2))
+    ON CONFLICT (date, time) DO UPDATE SET
+        bookings = bookings + excluded.bookings,
+        cancellations = cancellations + excluded.cancellations,
+        filled = MAX(filled + ?5, 0)
+'''
+# Повторная блокировка уже заблокированного слота не считается
+_COUNT_BLOCK_SQL = '''
+    INSERT INTO daily_stats (date, time, blocks, blocked) VALUES (?, ?, 1, 1)
+    ON CONFLICT (date, time) DO UPDATE SET blocks = blocks + 1 - blocked, blocked = 1
+'''
+_COUNT_UNBLOCK_SQL = 'UPDATE daily_stats SET blocked = 0 WHERE date = ? AND time = ?'
+_COUNT_SCHEDULED_SQL = '''
+    INSERT INTO daily_stats (date, time, scheduled) VALUES (?, ?, ?)
+    ON CONFLICT (date, time) DO UPDATE SET scheduled = excluded.scheduled
+'''
+
+# Пересчёт статуса материализованного слота по блокировкам и записям
+_REFRESH_SLOT_SQL = f'''
+    UPDATE slots SET status = CASE
+        WHEN EXISTS (SELECT 1 FROM blocked_slots b WHERE b.date = slots.date AND b.time = slots.time)
+            THEN '{SLOT_BLOCKED}'
+        WHEN EXISTS (SELECT 1 FROM appointments a WHERE a.date = slots.date AND a.time = slots.time)
+            THEN '{SLOT_BOOKED}'
+        ELSE '{SLOT_FREE}'
+    END
+    WHERE date = ? AND time = ?
+'''
+
+
+
+class BookingStatus(Enum):
+    BOOKED = 'booked'
+    SLOT_TAKEN = 'slot_taken'
+    ALREADY_BOOKED = 'already_booked'
+    BLOCKED = 'blocked'
+
+
+class BookingResult(NamedTuple):
+    status: BookingStatus
+    appointment: tuple | None = None  # (date, day, time) созданной или уже существующей записи
+
+
+_listeners = []
+
+
+def subscribe(listener):
+    """Подписка на события записи: listener(event, payload) вызывается после коммита"""
+    _listeners.append(listener)
+
+
+def _notify(event: str, **payload):
+    for listener in _listeners:
+        try:
+            listener(event, payload)
+        except Exception:
+            logger.exception(f"Ошибка обработчика события {event}")
+
+
+def slot_timestamp(date: str, time: str) -> int:
+    """Время начала слота в секундах epoch с учётом часового пояса"""
+    tz = pytz.timezone(TIMEZONE)
     try:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS new_appointments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                username TEXT,
-                full_name TEXT,
-                date TEXT NOT NULL,
-                day TEXT NOT NULL,
-                time TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        ''')
-        
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS blocked_slots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                time TEXT NOT NULL,
-                reason TEXT,
-                blocked_by INTEGER NOT NULL,
-                blocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
+        start = tz.localize(datetime.strptime(f"{date} {time}", '%Y-%m-%d %H:%M'))
+    except ValueError:
+        logger.warning(f"Некорректные дата и время записи: {date} {time}")
+        return 0
+    return int(start.timestamp())
+
+
+class ConnectionPool:
+    """Долгоживущие соединения: один писатель и несколько читателей в режиме WAL"""
+
+    def __init__(self, path: str, readers: int = DB_READERS,
+                 busy_timeout: int = DB_BUSY_TIMEOUT, statement_cache: int = DB_STATEMENT_CACHE):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self.busy_timeout = busy_timeout
+        self.statement_cache = statement_cache
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        self._all_readers = []
+
+    async def _connect(self):
+        # cached_statements - кэш подготовленных выражений sqlite3 на соединение
+        db = await aiosqlite.connect(
+            self.path,
+            timeout=self.busy_timeout / 1000,
+            cached_statements=self.statement_cache,
+        )
+        await db.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        await db.execute("PRAGMA foreign_keys = ON")
+        return db
+
+    async def open(self):
+        self._writer = await self._connect()
+        await self._writer.execute("PRAGMA journal_mode = WAL")
+        await self._writer.execute("PRAGMA synchronous = NORMAL")
+        for _ in range(self.readers_count):
+            db = await self._connect()
+            await db.execute("PRAGMA query_only = ON")
+            self._all_readers.append(db)
+            self._readers.put_nowait(db)
+        logger.info(f"Пул БД открыт: 1 писатель, {self.readers_count} читателей")
+
+    async def close(self):
+        for db in self._all_readers:
+            await db.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+        if self._writer is not None:
+            async with self._write_lock:
+                await self._writer.close()
+            self._writer = None
+        logger.info("Пул БД закрыт")
+
+    @asynccontextmanager
+    async def reader(self):
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def dedicated_reader(self):
+        """Отдельное соединение для долгих чтений, чтобы не занимать общий пул"""
+        db = await self._connect()
+        await db.execute("PRAGMA query_only = ON")
+        try:
+            yield db
+        finally:
+            await db.close()
+
+    @asynccontextmanager
+    async def writer(self):
+        # Запись в SQLite всё равно сериализуется, поэтому одно соединение под замком
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+
+_pool: ConnectionPool | None = None
+
+
+def _get_pool() -> ConnectionPool:
+    if _pool is None:
+        raise RuntimeError("База данных не инициализирована, вызовите init_db()")
+    return _pool
+
+
+def _reader():
+    return _get_pool().reader()
+
+
+def _writer():
+    return _get_pool().writer()
+
+
+async def close_db():
+    """Закрытие пула соединений при остановке бота"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+@timed_query
+async def book_slot(user_id: int, username: str, full_name: str, date: str, day: str, time: str) -> BookingResult:
+    """Проверка и запись в одной транзакции BEGIN IMMEDIATE"""
+    async with _writer() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cursor = await db.execute('''
+            SELECT date, day, time FROM appointments WHERE user_id = ?
+        ''', (user_id,))
+        existing = await cursor.fetchone()
+        if existing is not None:
+            await db.rollback()
+            return BookingResult(BookingStatus.ALREADY_BOOKED, existing)
+
+        # Занимаем слот календаря только если он свободен и не придержан для другого
+        cursor = await db.execute('''
+            UPDATE slots SET status = ?, held_by = NULL, held_until = 0
+            WHERE date = ? AND time = ? AND status = ?
+              AND (held_until <= ? OR held_by = ?)
+        ''', (SLOT_BOOKED, date, time, SLOT_FREE, int(clock.time()), user_id))
+        if cursor.rowcount == 0:
+            cursor = await db.execute('''
+                SELECT status FROM slots WHERE date = ? AND time = ?
+            ''', (date, time))
+            row = await cursor.fetchone()
+            await db.rollback()
+            if row is not None and row[0] == SLOT_BLOCKED:
+                return BookingResult(BookingStatus.BLOCKED)
+            # Слот занят или его больше нет в расписании
+            return BookingResult(BookingStatus.SLOT_TAKEN)
+
+        try:
+            await db.execute('''
+                INSERT INTO appointments (user_id, username, full_name, date, day, time, starts_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, username or "", full_name or "", date, day, time, slot_timestamp(date, time)))
+        except sqlite3.IntegrityError:
+            # Уникальный индекс (date, time): слот уже занят
+            await db.rollback()
+            return BookingResult(BookingStatus.SLOT_TAKEN)
+        await db.execute(_COUNT_BOOKING_SQL, (date, time, 1, 0, 1))
+        # Получатели рассылок - все, кто когда-либо записывался
+        await db.execute(_ADD_RECIPIENT_SQL, (user_id,))
+        # Записавшемуся лист ожидания больше не нужен
+        await db.execute(_LEAVE_WAITLIST_SQL, (user_id,))
+        await db.commit()
+    _notify(EVENT_BOOKED, user_id=user_id, date=date, day=day, time=time)
+    return BookingResult(BookingStatus.BOOKED, (date, day, time))
+
+@timed_query
+async def cancel_appointment(user_id: int):
+    async with _writer() as db:
+        cursor = await db.execute(
+            'DELETE FROM appointments WHERE user_id = ? RETURNING date, time', (user_id,)
+        )
+        rows = await cursor.fetchall()
+        await db.executemany(_REFRESH_SLOT_SQL, rows)
+        await db.executemany(_COUNT_BOOKING_SQL, [(date, time, 0, 1, -1) for date, time in rows])
+        await db.commit()
+    for date, time in rows:
+        _notify(EVENT_CANCELLED, user_id=user_id, date=date, time=time)
+
+@timed_query
+async def get_user_appointment(user_id: int):
+    async with _reader() as db:
+        cursor = await db.execute('''
+            SELECT date, day, time FROM appointments 
+            WHERE user_id = ?
+        ''', (user_id,))
+        return await cursor.fetchone()
+
+@timed_query
+async def get_active_appointments():
+    """Все активные записи: (user_id, date, day, time)"""
+    async with _reader() as db:
+        cursor = await db.execute('''
+            SELECT user_id, date, day, time FROM appointments
         ''')
-        
+        return await cursor.fetchall()
+
+@timed_query
+async def is_slot_available(date: str, time: str):
+    async with _reader() as db:
+        cursor = await db.execute('''
+            SELECT status FROM slots WHERE date = ? AND time = ? AND held_until <= ?
+        ''', (date, time, int(clock.time())))
+        row = await cursor.fetchone()
+        return row is not None and row[0] == SLOT_FREE
+
+@timed_query
+async def get_availability(date_from: str, date_to: str):
+    """Матрица доступности {дата: {время: статус}} одним проходом по первичному ключу slots"""
+    async with _reader() as db:
+        cursor = await db.execute('''
+            SELECT date, time, CASE WHEN status = ? AND held_until > ? THEN ? ELSE status END
+            FROM slots
+            WHERE date BETWEEN ? AND ?
+            ORDER BY date, time
+        ''', (SLOT_FREE, int(clock.time()), SLOT_HELD, date_from, date_to))
+        rows = await cursor.fetchall()
+
+    start = datetime.strptime(date_from, '%Y-%m-%d')
+    days = (datetime.strptime(date_to, '%Y-%m-%d') - start).days + 1
+    matrix = {(start + timedelta(days=i)).strftime('%Y-%m-%d'): {} for i in range(max(days, 0))}
+    for date, time, status in rows:
+        matrix[date][time] = status
+    return matrix
+
+@timed_query
+async def get_schedule_overrides(date_from: str, date_to: str):
+    """Особое расписание по датам: {дата: [времена]}, пустой список - выходной"""
+    async with _reader() as db:
+        cursor = await db.execute('''
+            SELECT date, times FROM schedule_overrides
+            WHERE date BETWEEN ? AND ?
+        ''', (date_from, date_to))
+        rows = await cursor.fetchall()
+    return {date: [t for t in times.split(',') if t] for date, times in rows}
+
+@timed_query
+async def set_schedule_override(date: str, times: list | None):
+    """Особое расписание на дату; None возвращает дату к недельному шаблону"""
+    async with _writer() as db:
+        if times is None:
+            await db.execute('DELETE FROM schedule_overrides WHERE date = ?', (date,))
+        else:
+            await db.execute('''
+                INSERT INTO schedule_overrides (date, times) VALUES (?, ?)
+                ON CONFLICT (date) DO UPDATE SET times = excluded.times
+            ''', (date, ','.join(times)))
+        await db.commit()
+
+@timed_query
+async def sync_slots(date_from: str, date_to: str, desired: list):
+    """Приведение slots в диапазоне к расписанию desired [(дата, время)] одной транзакцией.
+
+    Прошедшие даты удаляются, новые слоты получают статус по блокировкам и записям,
+    свободные слоты вне расписания убираются. Возвращает изменённые даты.
+    """
+    async with _writer() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        await db.execute('DELETE FROM slots WHERE date < ?', (date_from,))
+        cursor = await db.execute('''
+            SELECT date, time, status FROM slots WHERE date BETWEEN ? AND ?
+        ''', (date_from, date_to))
+        existing = {(date, time): status for date, time, status in await cursor.fetchall()}
+        wanted = set(desired)
+        added = [slot for slot in desired if slot not in existing]
+        # Занятые и заблокированные слоты остаются, даже если выпали из расписания
+        removed = [slot for slot, status in existing.items() if slot not in wanted and status == SLOT_FREE]
+
+        await db.executemany('''
+            INSERT INTO slots (date, time) VALUES (?, ?)
+        ''', added)
+        await db.executemany(_REFRESH_SLOT_SQL, added)
+        await db.executemany('''
+            DELETE FROM slots WHERE date = ? AND time = ?
+        ''', removed)
+        await db.executemany(_COUNT_SCHEDULED_SQL, [(date, time, 1) for date, time in added])
+        await db.executemany(_COUNT_SCHEDULED_SQL, [(date, time, 0) for date, time in removed])
+        await db.commit()
+
+    changed = sorted({date for date, _ in added + removed})
+    for date in changed:
+        _notify(EVENT_SCHEDULE, date=date)
+    return changed
+
+@timed_query
+async def block_slots(slots: list, admin_id: int, reason: str = None):
+    """Блокировка набора слотов [(дата, время)] одной транзакцией.
+
+    Повторная блокировка обновляет причину. Возвращает записи клиентов,
+    попавшие на заблокированные слоты: (date, time, user_id, full_name).
+    """
+    slots = sorted(set(slots))
+    if not slots:
+        return []
+    async with _writer() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        await db.executemany('''
+            INSERT INTO blocked_slots (date, time, reason, blocked_by)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (date, time) DO UPDATE SET
+                reason = excluded.reason,
+                blocked_by = excluded.blocked_by
+        ''', [(date, time, reason or "", admin_id) for date, time in slots])
+        await db.executemany(_REFRESH_SLOT_SQL, slots)
+        await db.executemany(_COUNT_BLOCK_SQL, slots)
+        cursor = await db.execute('''
+            SELECT date, time, user_id, full_name FROM appointments
+            WHERE date BETWEEN ? AND ?
+            ORDER BY date, time
+        ''', (slots[0][0], slots[-1][0]))
+        wanted = set(slots)
+        conflicts = [row for row in await cursor.fetchall() if (row[0], row[1]) in wanted]
+        await db.commit()
+    for date, time in slots:
+        _notify(EVENT_BLOCKED, date=date, time=time)
+    return conflicts
+
+@timed_query
+async def unblock_slots(dates: list, times: list | None = None):
+    """Снятие блокировок на датах dates (только времена times, если заданы), возвращает снятые слоты"""
+    if not dates:
+        return []
+    async with _writer() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cursor = await db.execute('''
+            SELECT date, time FROM blocked_slots
+            WHERE date BETWEEN ? AND ?
+            ORDER BY date, time
+        ''', (min(dates), max(dates)))
+        dates = set(dates)
+        removed = [
+            (date, time) for date, time in await cursor.fetchall()
+            if date in dates and (times is None or time in times)
+        ]
+        await db.executemany('''
+            DELETE FROM blocked_slots 
+            WHERE date = ? AND time = ?
+        ''', removed)
+        await db.executemany(_REFRESH_SLOT_SQL, removed)
+        await db.executemany(_COUNT_UNBLOCK_SQL, removed)
+        await db.commit()
+    for date, time in removed:
+        _notify(EVENT_UNBLOCKED, date=date, time=time)
+    return removed
+
+async def block_slot(date: str, time: str, admin_id: int, reason: str = None):
+    return await block_slots([(date, time)], admin_id, reason)
+
+async def unblock_slot(date: str, time: str):
+    return await unblock_slots([date], [time])
+
+@timed_query
+async def get_blocked_slots(date_from: str, after: tuple = None, before: tuple = None,
+                            limit: int = BLOCKED_PAGE_SIZE):
+    """Страница блокировок начиная с date_from с keyset-пагинацией по (date, time).
+
+    after/before - ключ (date, time) последней/первой строки соседней страницы.
+    Возвращает (строки, есть_ещё_в_направлении_листания).
+    """
+    async with _reader() as db:
+        if before is not None:
+            cursor = await db.execute('''
+                SELECT date, time, reason, blocked_by FROM blocked_slots
+                WHERE date >= ? AND (date, time) < (?, ?)
+                ORDER BY date DESC, time DESC LIMIT ?
+            ''', (date_from, *before, limit + 1))
+            rows = await cursor.fetchall()
+            return list(reversed(rows[:limit])), len(rows) > limit
+
+        after = after or ('', '')
+        cursor = await db.execute('''
+            SELECT date, time, reason, blocked_by FROM blocked_slots
+            WHERE date >= ? AND (date, time) > (?, ?)
+            ORDER BY date, time LIMIT ?
+        ''', (date_from, *after, limit + 1))
+        rows = await cursor.fetchall()
+        return rows[:limit], len(rows) > limit
+
+async def iter_appointments(date_from: str, date_to: str, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Активные и архивные записи за период пачками по chunk_size строк.
+
+    Читает через отдельное соединение: в режиме WAL долгое чтение не мешает
+    записи и не занимает читателей общего пула.
+    """
+    async with _get_pool().dedicated_reader() as db:
+        cursor = await db.execute('''
+            SELECT id, user_id, username, full_name, date, day, time, created_at, 'active'
+            FROM appointments WHERE date BETWEEN ? AND ?
+            UNION ALL
+            SELECT id, user_id, username, full_name, date, day, time, created_at, 'archived'
+            FROM appointments_archive WHERE date BETWEEN ? AND ?
+            ORDER BY 5, 7
+        ''', (date_from, date_to, date_from, date_to))
+        while True:
+            rows = await cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+@timed_query
+async def archive_past_blocks(date_before: str, batch_size: int = SWEEP_BATCH_SIZE):
+    """Перенос блокировок прошедших дат в blocked_slots_archive пачками"""
+    total = 0
+    while True:
+        async with _writer() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            # Пачка отбирается один раз: в архив идут ровно удалённые строки.
+            # Два отдельных SELECT ... LIMIT могли бы вернуть разные строки с одной датой
+            cursor = await db.execute('''
+                DELETE FROM blocked_slots WHERE id IN (
+                    SELECT id FROM blocked_slots
+                    WHERE date < ?
+                    ORDER BY date LIMIT ?
+                )
+                RETURNING id, date, time, reason, blocked_by, blocked_at
+            ''', (date_before, batch_size))
+            rows = await cursor.fetchall()
+            await db.executemany('''
+                INSERT INTO blocked_slots_archive
+                    (id, date, time, reason, blocked_by, blocked_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            archived = len(rows)
+            await db.commit()
+        total += archived
+        if archived < batch_size:
+            return total
+
+@timed_query
+async def delete_expired_appointments(batch_size: int = SWEEP_BATCH_SIZE):
+    """Перенос прошедших записей в архив пачками, возвращает количество перенесённых"""
+    now = int(datetime.now(pytz.timezone(TIMEZONE)).timestamp())
+    total = 0
+    while True:
+        # Каждая пачка - отдельная короткая транзакция, записи клиентов идут между ними
+        async with _writer() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            # Пачка отбирается один раз: в архив идут ровно удалённые записи
+            cursor = await db.execute('''
+                DELETE FROM appointments WHERE id IN (
+                    SELECT id FROM appointments
+                    WHERE starts_at < ?
+                    ORDER BY starts_at LIMIT ?
+                )
+                RETURNING id, user_id, username, full_name, date, day, time, created_at, starts_at
+            ''', (now, batch_size))
+            rows = await cursor.fetchall()
+            await db.executemany('''
+                INSERT INTO appointments_archive
+                    (id, user_id, username, full_name, date, day, time, created_at, starts_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            await db.executemany(_REFRESH_SLOT_SQL, [(row[4], row[6]) for row in rows])
+            await db.commit()
+        for _, user_id, _, _, date, _, time, _, _ in rows:
+            _notify(EVENT_EXPIRED, user_id=user_id, date=date, time=time)
+        total += len(rows)
+        if len(rows) < batch_size:
+            return total
+
+@timed_query
+async def get_pending_reminders(starts_after: int, starts_until: int):
+    """Записи без отправленного напоминания, начинающиеся в (starts_after, starts_until]"""
+    async with _reader() as db:
+        cursor = await db.execute('''
+            SELECT user_id, date, day, time, starts_at FROM appointments
+            WHERE reminder_sent = 0 AND starts_at > ? AND starts_at <= ?
+            ORDER BY starts_at
+        ''', (starts_after, starts_until))
+        return await cursor.fetchall()
+
+@timed_query
+async def claim_reminder(user_id: int, date: str, time: str) -> bool:
+    """Отметка об отправке напоминания; False - запись отменена или напоминание уже ушло"""
+    async with _writer() as db:
+        cursor = await db.execute('''
+            UPDATE appointments SET reminder_sent = 1
+            WHERE user_id = ? AND date = ? AND time = ? AND reminder_sent = 0
+        ''', (user_id, date, time))
+        await db.commit()
+    return cursor.rowcount > 0
+
+@timed_query
+async def add_to_waitlist(user_id: int, date: str, time: str) -> bool:
+    """False - пользователь уже ждёт этот слот"""
+    async with _writer() as db:
+        cursor = await db.execute(
+            'INSERT OR IGNORE INTO waitlist (user_id, date, time) VALUES (?, ?, ?)', (user_id, date, time)
+        )
+        await db.commit()
+    return cursor.rowcount > 0
+
+@timed_query
+async def pop_waitlist(date: str, time: str):
+    """Первый в очереди на слот, удаляется из неё; None - очередь пуста"""
+    async with _writer() as db:
+        cursor = await db.execute('''
+            DELETE FROM waitlist WHERE id = (
+                SELECT id FROM waitlist WHERE date = ? AND time = ? ORDER BY id LIMIT 1
+            )
+            RETURNING user_id
+        ''', (date, time))
+        row = await cursor.fetchone()
+        await db.commit()
+    return row[0] if row else None
+
+@timed_query
+async def hold_slot(date: str, time: str, user_id: int, until: int) -> bool:
+    """Придержать свободный слот для user_id до until (epoch); False - слот уже занят или заблокирован"""
+    async with _writer() as db:
+        cursor = await db.execute('''
+            UPDATE slots SET held_by = ?, held_until = ?
+            WHERE date = ? AND time = ? AND status = ?
+        ''', (user_id, until, date, time, SLOT_FREE))
+        await db.commit()
+    if cursor.rowcount:
+        _notify(EVENT_HELD, date=date, time=time)
+    return cursor.rowcount > 0
+
+@timed_query
+async def release_slot(date: str, time: str):
+    """Снятие удержания слота"""
+    async with _writer() as db:
+        cursor = await db.execute('''
+            UPDATE slots SET held_by = NULL, held_until = 0
+            WHERE date = ? AND time = ? AND held_by IS NOT NULL
+        ''', (date, time))
+        await db.commit()
+    if cursor.rowcount:
+        _notify(EVENT_HELD, date=date, time=time)
+
+@timed_query
+async def prune_waitlist(date_before: str) -> int:
+    async with _writer() as db:
+        cursor = await db.execute('DELETE FROM waitlist WHERE date < ?', (date_before,))
+        await db.commit()
+    return cursor.rowcount
+
+@timed_query
+async def create_broadcast(text: str, created_by: int):
+    """Новая рассылка: (id, текст, последний user_id, отправлено, ошибок, получателей)"""
+    async with _writer() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cursor = await db.execute('''
+            INSERT INTO broadcasts (text, created_by, total)
+            SELECT ?, ?, COUNT(*) FROM broadcast_recipients
+            RETURNING id, text, last_user_id, sent, failed, total
+        ''', (text, created_by))
+        row = await cursor.fetchone()
+        await db.commit()
+    return row
+
+@timed_query
+async def get_running_broadcast():
+    async with _reader() as db:
+        cursor = await db.execute('''
+            SELECT id, text, last_user_id, sent, failed, total FROM broadcasts
+            WHERE status = ? ORDER BY id LIMIT 1
+        ''', (BROADCAST_RUNNING,))
+        return await cursor.fetchone()
+
+@timed_query
+async def get_broadcast_recipients(after_user_id: int, limit: int):
+    """Следующая пачка получателей после контрольной точки"""
+    async with _reader() as db:
+        cursor = await db.execute('''
+            SELECT user_id FROM broadcast_recipients
+            WHERE user_id > ? ORDER BY user_id LIMIT ?
+        ''', (after_user_id, limit))
+        return [user_id for (user_id,) in await cursor.fetchall()]
+
+@timed_query
+async def save_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, failed: int,
+                                  status: str = BROADCAST_RUNNING):
+    async with _writer() as db:
         await db.execute('''
-            INSERT INTO new_appointments (id, user_id, date, day, time, created_at)
-            SELECT id, user_id, date, day, time, created_at FROM appointments
-        ''')
-        
-        await db.execute('DROP TABLE appointments')
-        await db.execute('ALTER TABLE new_appointments RENAME TO appointments')
+            UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, status = ?
+            WHERE id = ?
+        ''', (last_user_id, sent, failed, status, broadcast_id))
+        await db.commit()
+
+@timed_query
+async def prune_recipients(user_ids: list):
+    """Удаление заблокировавших бота и удалённых аккаунтов"""
+    async with _writer() as db:
+        await db.executemany(
+            'DELETE FROM broadcast_recipients WHERE user_id = ?', [(user_id,) for user_id in user_ids]
+        )
+        await db.commit()
+
+@timed_query
+async def get_fsm_record(key: str, updated_after: int):
+    """(state, data, updated_at) состояния FSM, обновлённого позже updated_after; None - нет или устарело"""
+    async with _reader() as db:
+        cursor = await db.execute('''
+            SELECT state, data, updated_at FROM fsm_states WHERE key = ? AND updated_at > ?
+        ''', (key, updated_after))
+        return await cursor.fetchone()
+
+@timed_query
+async def save_fsm_records(records: list, deleted: list):
+    """Пачка изменений FSM одной транзакцией: records [(key, state, data, updated_at)], deleted [key]"""
+    async with _writer() as db:
+        await db.executemany('''
+            INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+        ''', records)
+        await db.executemany('DELETE FROM fsm_states WHERE key = ?', [(key,) for key in deleted])
+        await db.commit()
+
+@timed_query
+async def delete_expired_fsm_records(updated_before: int) -> int:
+    async with _writer() as db:
+        cursor = await db.execute('DELETE FROM fsm_states WHERE updated_at <= ?', (updated_before,))
+        await db.commit()
+    return cursor.rowcount
+
+@timed_query
+async def get_daily_stats(date_from: str, date_to: str):
+    """Сводка за период по времени слота из daily_stats, без обращения к записям.
+
+    Возвращает [(time, записей, отмен, блокировок, доступных слотов, занятых слотов)].
+    """
+    async with _reader() as db:
+        cursor = await db.execute('''
+            SELECT time, SUM(bookings), SUM(cancellations), SUM(blocks),
+                   SUM(MAX(scheduled - blocked, filled)), SUM(filled)
+            FROM daily_stats
+            WHERE date BETWEEN ? AND ?
+            GROUP BY time ORDER BY time
+        ''', (date_from, date_to))
+        return await cursor.fetchall()
+
+@timed_query
+async def save_pending_notifications(chat_id: int, texts: list):
+    """Сохранение неотправленных уведомлений при остановке"""
+    if not texts:
+        return
+    async with _writer() as db:
+        await db.executemany('''
+            INSERT INTO pending_notifications (chat_id, text) VALUES (?, ?)
+        ''', [(chat_id, text) for text in texts])
         await db.commit()
-        logger.info("Миграция БД успешно завершена")
-    except Exception as e:
-        await db.rollback()
-        logger.error(f"Ошибка миграции БД: {e}")
-        raise
 
-async def create_tables(db):
+@timed_query
+async def take_pending_notifications(chat_id: int):
+    """Извлечение сохранённых уведомлений в порядке поступления"""
+    async with _writer() as db:
+        cursor = await db.execute('''
+            DELETE FROM pending_notifications WHERE chat_id = ?
+            RETURNING id, text
+        ''', (chat_id,))
+        rows = await cursor.fetchall()
+        await db.commit()
+    return [text for _, text in sorted(rows)]
+
+async def init_db():
+    """Открытие пула и применение недостающих миграций схемы"""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(DB_NAME)
+        await _pool.open()
+
+    async with _writer() as db:
+        await apply_migrations(db)
+
+async def apply_migrations(db):
+    """Миграции по номеру версии в PRAGMA user_version; актуальная БД - одно чтение прагмы"""
+    cursor = await db.execute("PRAGMA user_version")
+    (version,) = await cursor.fetchone()
+    if version >= SCHEMA_VERSION:
+        return
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        logger.info(f"Миграция БД {number}/{SCHEMA_VERSION}: {migration.__doc__}")
+        # Схема и номер версии фиксируются одной транзакцией
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {number}")
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            logger.error(f"Ошибка миграции БД {number}, версия остаётся {number - 1}")
+            raise
+
+async def _migrate_base_tables(db):
+    """таблицы записей и блокировок"""
     await db.execute('''
         CREATE TABLE IF NOT EXISTS appointments (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -92,136 +807,357 @@ async def create_tables(db):
             blocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
     ''')
-    await db.commit()
+    # Старые БД без имени пользователя: добавляем столбцы вместо копирования таблицы
+    cursor = await db.execute("PRAGMA table_info(appointments)")
+    column_names = {col[1] for col in await cursor.fetchall()}
+    for column in ('username', 'full_name'):
+        if column not in column_names:
+            await db.execute(f"ALTER TABLE appointments ADD COLUMN {column} TEXT")
 
-async def add_appointment(user_id: int, username: str, full_name: str, date: str, day: str, time: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''
-            INSERT INTO appointments (user_id, username, full_name, date, day, time)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, username or "", full_name or "", date, day, time))
-        await db.commit()
+_CONFLICTS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS appointment_conflicts (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        username TEXT,
+        full_name TEXT,
+        date TEXT NOT NULL,
+        day TEXT NOT NULL,
+        time TEXT NOT NULL,
+        reason TEXT NOT NULL,
+        reported INTEGER NOT NULL DEFAULT 0,
+        moved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
 
-async def cancel_appointment(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('DELETE FROM appointments WHERE user_id = ?', (user_id,))
-        await db.commit()
+async def _move_conflicts(db, group_by: str, reason: str) -> int:
+    """Перенос всех записей группы, кроме первой, в appointment_conflicts"""
+    duplicates = f'id NOT IN (SELECT MIN(id) FROM appointments GROUP BY {group_by})'
+    await db.execute(f'''
+        INSERT INTO appointment_conflicts (id, user_id, username, full_name, date, day, time, reason)
+        SELECT id, user_id, username, full_name, date, day, time, ?
+        FROM appointments WHERE {duplicates}
+    ''', (reason,))
+    cursor = await db.execute(f'DELETE FROM appointments WHERE {duplicates}')
+    return cursor.rowcount
 
-async def get_user_appointment(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute('''
-            SELECT date, day, time FROM appointments 
-            WHERE user_id = ?
-        ''', (user_id,))
-        return await cursor.fetchone()
+async def _migrate_unique_slots(db):
+    """уникальные индексы слотов и записей"""
+    # Перед созданием уникальных индексов убираем накопившиеся дубли. Записи клиентов
+    # не удаляются, а переносятся в appointment_conflicts - администратор получит их список
+    await db.execute(_CONFLICTS_TABLE_SQL)
+    moved = await _move_conflicts(db, 'date, time', 'слот уже занят')
+    if moved > 0:
+        logger.warning(f"Перенесено в appointment_conflicts дублирующих записей на один слот: {moved}")
+    moved = await _move_conflicts(db, 'user_id', 'у клиента уже есть запись')
+    if moved > 0:
+        logger.warning(f"Перенесено в appointment_conflicts лишних записей пользователей: {moved}")
+    await db.execute('''
+        DELETE FROM blocked_slots WHERE id NOT IN (
+            SELECT MIN(id) FROM blocked_slots GROUP BY date, time
+        )
+    ''')
 
-async def is_slot_available(date: str, time: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Проверяем блокировку
-        cursor = await db.execute('''
-            SELECT * FROM blocked_slots 
-            WHERE date = ? AND time = ?
-        ''', (date, time))
-        if await cursor.fetchone() is not None:
-            return False
-            
-        # Проверяем занятость
-        cursor = await db.execute('''
-            SELECT * FROM appointments 
-            WHERE date = ? AND time = ?
-        ''', (date, time))
-        return await cursor.fetchone() is None
+    await db.execute("DROP INDEX IF EXISTS idx_appointments_date_time")
+    await db.execute("DROP INDEX IF EXISTS idx_blocked_slots_date_time")
+    await db.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_appointments_slot
+        ON appointments (date, time)
+    ''')
+    await db.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_appointments_user
+        ON appointments (user_id)
+    ''')
+    await db.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_blocked_slots_slot
+        ON blocked_slots (date, time)
+    ''')
 
-async def block_slot(date: str, time: str, admin_id: int, reason: str = None):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''
-            INSERT INTO blocked_slots (date, time, reason, blocked_by)
-            VALUES (?, ?, ?, ?)
-        ''', (date, time, reason or "", admin_id))
-        await db.commit()
+async def _migrate_starts_at(db):
+    """время начала записи (epoch) и архив прошедших записей"""
+    cursor = await db.execute("PRAGMA table_info(appointments)")
+    column_names = {col[1] for col in await cursor.fetchall()}
+    if 'starts_at' not in column_names:
+        await db.execute("ALTER TABLE appointments ADD COLUMN starts_at INTEGER")
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_appointments_starts_at
+        ON appointments (starts_at)
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS appointments_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            full_name TEXT,
+            date TEXT NOT NULL,
+            day TEXT NOT NULL,
+            time TEXT NOT NULL,
+            created_at TIMESTAMP,
+            starts_at INTEGER,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_appointments_archive_date
+        ON appointments_archive (date, time)
+    ''')
 
-async def unblock_slot(date: str, time: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''
-            DELETE FROM blocked_slots 
-            WHERE date = ? AND time = ?
-        ''', (date, time))
+async def _backfill_starts_at(db):
+    """заполнение starts_at у старых записей"""
+    # Пачками, каждая своей транзакцией, чтобы не держать блокировку на всю таблицу.
+    # При сбое уже заполненные строки не повторяются: отбор по starts_at IS NULL
+    while True:
+        cursor = await db.execute('''
+            SELECT id, date, time FROM appointments
+            WHERE starts_at IS NULL LIMIT ?
+        ''', (SWEEP_BATCH_SIZE,))
+        rows = await cursor.fetchall()
+        if not rows:
+            break
+        await db.executemany(
+            'UPDATE appointments SET starts_at = ? WHERE id = ?',
+            [(slot_timestamp(date, time), row_id) for row_id, date, time in rows]
+        )
         await db.commit()
+        await db.execute("BEGIN IMMEDIATE")
 
-async def get_blocked_slots():
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute('''
-            SELECT date, time, reason, blocked_by FROM blocked_slots
-        ''')
-        return await cursor.fetchall()
+async def _migrate_notifications(db):
+    """отложенные уведомления администратору"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS pending_notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
 
-async def delete_expired_appointments():
-    now = datetime.now(pytz.timezone(TIMEZONE))
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''
-            DELETE FROM appointments 
-            WHERE datetime(date || ' ' || time) < datetime(?)
-        ''', (now.strftime('%Y-%m-%d %H:%M'),))
+async def _migrate_calendar(db):
+    """материализованный календарь слотов и особое расписание по датам"""
+    await db.execute(f'''
+        CREATE TABLE IF NOT EXISTS slots (
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT '{SLOT_FREE}',
+            PRIMARY KEY (date, time)
+        ) WITHOUT ROWID;
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS schedule_overrides (
+            date TEXT PRIMARY KEY,
+            times TEXT NOT NULL DEFAULT ''
+        ) WITHOUT ROWID;
+    ''')
+
+async def _migrate_blocked_archive(db):
+    """архив прошедших блокировок"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS blocked_slots_archive (
+            id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            reason TEXT,
+            blocked_by INTEGER NOT NULL,
+            blocked_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+
+async def _migrate_reminders(db):
+    """отметка об отправленном напоминании"""
+    cursor = await db.execute("PRAGMA table_info(appointments)")
+    column_names = {col[1] for col in await cursor.fetchall()}
+    if 'reminder_sent' not in column_names:
+        await db.execute("ALTER TABLE appointments ADD COLUMN reminder_sent INTEGER NOT NULL DEFAULT 0")
+    # Частичный индекс: только записи, ждущие напоминания
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_appointments_reminder
+        ON appointments (starts_at) WHERE reminder_sent = 0
+    ''')
+
+async def _migrate_broadcasts(db):
+    """рассылки и их получатели"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            user_id INTEGER PRIMARY KEY,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    await db.execute(f'''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            created_by INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT NOT NULL DEFAULT '{BROADCAST_RUNNING}',
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            last_user_id INTEGER NOT NULL DEFAULT 0
+        );
+    ''')
+    await db.execute('''
+        INSERT OR IGNORE INTO broadcast_recipients (user_id)
+        SELECT user_id FROM appointments
+    ''')
+    # Архив может быть большим - переносим пачками, как заполнение starts_at
+    last_id = 0
+    while True:
+        cursor = await db.execute('''
+            SELECT id, user_id FROM appointments_archive
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, SWEEP_BATCH_SIZE))
+        rows = await cursor.fetchall()
+        if not rows:
+            break
+        await db.executemany(_ADD_RECIPIENT_SQL, [(user_id,) for _, user_id in rows])
+        last_id = rows[-1][0]
         await db.commit()
+        await db.execute("BEGIN IMMEDIATE")
 
-async def init_db():
-    """Инициализация базы данных с автоматической миграцией"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        
-        # Проверяем существование всех таблиц
-        cursor = await db.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        existing_tables = {row[0] for row in await cursor.fetchall()}
-        
-        # Если ни одной таблицы нет, создаем все с нуля
-        if not existing_tables:
-            logger.info("Создание таблиц с нуля...")
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS appointments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    username TEXT,
-                    full_name TEXT,
-                    date TEXT NOT NULL,
-                    day TEXT NOT NULL,
-                    time TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            ''')
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS blocked_slots (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    date TEXT NOT NULL,
-                    time TEXT NOT NULL,
-                    reason TEXT,
-                    blocked_by INTEGER NOT NULL,
-                    blocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            ''')
-            await db.commit()
-            return
-        
-        # Если есть таблица appointments, но нет blocked_slots
-        if 'appointments' in existing_tables and 'blocked_slots' not in existing_tables:
-            logger.info("Создание таблицы blocked_slots...")
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS blocked_slots (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    date TEXT NOT NULL,
-                    time TEXT NOT NULL,
-                    reason TEXT,
-                    blocked_by INTEGER NOT NULL,
-                    blocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
+async def _migrate_waitlist(db):
+    """лист ожидания занятых слотов"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS waitlist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    # rowid входит в индекс неявно: очередь слота читается по (date, time, id) без сортировки
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_waitlist_slot
+        ON waitlist (date, time)
+    ''')
+    await db.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_waitlist_user_slot
+        ON waitlist (user_id, date, time)
+    ''')
+
+async def _migrate_fsm(db):
+    """состояния FSM пользователей"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at INTEGER NOT NULL
+        ) WITHOUT ROWID;
+    ''')
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at
+        ON fsm_states (updated_at)
+    ''')
+
+async def _migrate_daily_stats(db):
+    """сводка по слотам для отчётов и неизменяемый архив"""
+    # filled и blocked - текущее состояние слота (0/1), остальное - счётчики событий
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            cancellations INTEGER NOT NULL DEFAULT 0,
+            blocks INTEGER NOT NULL DEFAULT 0,
+            scheduled INTEGER NOT NULL DEFAULT 0,
+            filled INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (date, time)
+        ) WITHOUT ROWID;
+    ''')
+    # Начальное заполнение по уже накопленным данным; отмены до этой миграции не сохранялись
+    await db.execute('''
+        INSERT OR IGNORE INTO daily_stats (date, time, scheduled)
+        SELECT date, time, 1 FROM slots
+    ''')
+    await db.execute('''
+        INSERT INTO daily_stats (date, time, bookings, filled)
+        SELECT date, time, COUNT(*), COUNT(*) FROM (
+            SELECT date, time FROM appointments
+            UNION ALL
+            SELECT date, time FROM appointments_archive
+        ) WHERE true
+        GROUP BY date, time
+        ON CONFLICT (date, time) DO UPDATE SET
+            bookings = excluded.bookings,
+            filled = excluded.filled
+    ''')
+    await db.execute('''
+        INSERT INTO daily_stats (date, time, blocks, blocked)
+        SELECT date, time, COUNT(*), MAX(active) FROM (
+            SELECT date, time, 1 AS active FROM blocked_slots
+            UNION ALL
+            SELECT date, time, 0 AS active FROM blocked_slots_archive
+        ) WHERE true
+        GROUP BY date, time
+        ON CONFLICT (date, time) DO UPDATE SET
+            blocks = excluded.blocks,
+            blocked = excluded.blocked
+    ''')
+    # Архивы только пополняются: изменение и удаление строк запрещены
+    for table in ('appointments_archive', 'blocked_slots_archive'):
+        for action in ('UPDATE', 'DELETE'):
+            await db.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_no_{action.lower()}
+                BEFORE {action} ON {table}
+                BEGIN
+                    SELECT RAISE(ABORT, '{table} is append-only');
+                END
             ''')
-            await db.commit()
-        
-        # Проверяем структуру таблицы appointments
-        cursor = await db.execute("PRAGMA table_info(appointments)")
-        columns = await cursor.fetchall()
-        column_names = {col[1] for col in columns}
-        required_columns = {'user_id', 'username', 'full_name', 'date', 'day', 'time'}
-        
-        if not required_columns.issubset(column_names):
-            logger.warning("Обнаружена устаревшая структура таблицы appointments, выполняется миграция...")
-            await migrate_database(db)
\ No newline at end of file
+
+async def _report_conflicts(db):
+    """уведомление администратору о записях, снятых при создании уникальных индексов"""
+    # БД, прошедшие вторую миграцию до появления таблицы, получают её пустой
+    await db.execute(_CONFLICTS_TABLE_SQL)
+    cursor = await db.execute('''
+        SELECT user_id, username, full_name, date, time, reason
+        FROM appointment_conflicts WHERE reported = 0 ORDER BY date, time
+    ''')
+    rows = await cursor.fetchall()
+    if not rows:
+        return
+    if not ADMIN_ID:
+        logger.warning(f"Записей в appointment_conflicts: {len(rows)}, ADMIN_ID не задан - уведомить некого")
+        return
+    await db.executemany('''
+        INSERT INTO pending_notifications (chat_id, text) VALUES (?, ?)
+    ''', [
+        (ADMIN_ID,
+         f"⚠️ Запись снята при обновлении БД ({reason}):\n"
+         f"📅 {date} ⏰ {time}\n"
+         f"👤 {full_name or '-'} (@{username or '-'}, id {user_id})\n"
+         f"Свяжитесь с клиентом, чтобы перенести запись")
+        for user_id, username, full_name, date, time, reason in rows
+    ])
+    await db.execute('UPDATE appointment_conflicts SET reported = 1 WHERE reported = 0')
+
+async def _migrate_slot_holds(db):
+    """удержание освободившегося слота для ожидающего"""
+    cursor = await db.execute("PRAGMA table_info(slots)")
+    column_names = {col[1] for col in await cursor.fetchall()}
+    if 'held_by' not in column_names:
+        await db.execute("ALTER TABLE slots ADD COLUMN held_by INTEGER")
+    if 'held_until' not in column_names:
+        await db.execute("ALTER TABLE slots ADD COLUMN held_until INTEGER NOT NULL DEFAULT 0")
+
+# Порядок менять нельзя: номер миграции = её позиция в списке.
+# Новые миграции только дописываются в конец. Каждая идемпотентна,
+# чтобы БД, созданные до появления user_version, проходили их без ошибок
+MIGRATIONS = [
+    _migrate_base_tables,
+    _migrate_unique_slots,
+    _migrate_starts_at,
+    _backfill_starts_at,
+    _migrate_notifications,
+    _migrate_calendar,
+    _migrate_blocked_archive,
+    _migrate_reminders,
+    _migrate_broadcasts,
+    _migrate_waitlist,
+    _migrate_fsm,
+    _migrate_daily_stats,
+    _report_conflicts,
+    _migrate_slot_holds,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
\ No newline at end of file
@@ -0,0 +1,42 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import aiofiles
+from database import iter_appointments
+
+COLUMNS = ["id", "user_id", "username", "full_name", "date", "day", "time", "created_at", "status"]
+FORMATS = ("csv", "json")
+
+
+def _format_chunk(rows: list, fmt: str) -> str:
+    if fmt == "json":
+        # NDJSON: одна запись на строку, файл читается потоково
+        return "".join(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+async def export_appointments(date_from: str, date_to: str, fmt: str = "csv"):
+    """Выгрузка записей за период во временный файл; возвращает (путь, количество строк).
+
+    Строки читаются и пишутся пачками, поэтому память не зависит от объёма.
+    Удалить файл после отправки - забота вызывающего.
+    """
+    suffix = ".csv" if fmt == "csv" else ".ndjson"
+    fd, path = tempfile.mkstemp(prefix="appointments_", suffix=suffix)
+    os.close(fd)
+    count = 0
+    try:
+        async with aiofiles.open(path, "w", encoding="utf-8", newline="") as f:
+            if fmt == "csv":
+                await f.write(_format_chunk([COLUMNS], fmt))
+            async for rows in iter_appointments(date_from, date_to):
+                await f.write(_format_chunk(rows, fmt))
+                count += len(rows)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from copy import copy
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from config import FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL, FSM_STATE_TTL
+from database import get_fsm_record, save_fsm_records
+from metrics import background_task, register_collector
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """Состояния FSM в файле БД бота с кэшем LRU и отложенной записью.
+
+    Чтение и запись идут в памяти; изменения копятся и пишутся в SQLite одной
+    транзакцией раз в FSM_FLUSH_INTERVAL и при закрытии. При промахе состояние
+    читается из БД. Состояние, не менявшееся дольше FSM_STATE_TTL, считается пустым.
+    """
+
+    def __init__(self, maxsize: int = FSM_CACHE_SIZE, flush_interval: float = FSM_FLUSH_INTERVAL,
+                 ttl: int = FSM_STATE_TTL):
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._records = OrderedDict()  # StorageKey -> [state, data, updated_at]
+        self._dirty = set()  # Ключи с изменениями, ещё не записанными в БД
+        self._flushing = set()  # Ключи, которые пишутся сейчас: до конца записи не вытесняются
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._closed = False
+
+    @staticmethod
+    def _db_key(key: StorageKey) -> str:
+        parts = (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+        return ":".join("" if part is None else str(part) for part in parts)
+
+    async def _get(self, key: StorageKey) -> list:
+        now = time.time()
+        record = self._records.get(key)
+        if record is not None:
+            self.hits += 1
+            self._records.move_to_end(key)
+            if record[2] <= now - self.ttl:
+                record = self._records[key] = [None, {}, now]
+            return record
+
+        self.misses += 1
+        row = await get_fsm_record(self._db_key(key), int(now - self.ttl))
+        # Пока шло чтение, состояние могли записать
+        if key in self._records:
+            return self._records[key]
+        record = [row[0], json.loads(row[1]), row[2]] if row else [None, {}, now]
+        self._records[key] = record
+        self._evict()
+        return record
+
+    async def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        self._records[key] = [state, data, time.time()]
+        self._records.move_to_end(key)
+        self._dirty.add(key)
+        self._evict()
+        if self._flush_task is None and not self._closed:
+            self._flush_task = background_task(self._run())
+
+    def _evict(self):
+        # Вытесняем только записанные в БД; несохранённые дождутся сброса
+        excess = len(self._records) - self.maxsize
+        if excess <= 0:
+            return
+        victims = []
+        for key in self._records:
+            if key not in self._dirty and key not in self._flushing:
+                victims.append(key)
+                if len(victims) == excess:
+                    break
+        for key in victims:
+            del self._records[key]
+
+    async def flush(self):
+        """Запись накопленных изменений одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            keys, self._dirty = self._dirty, set()
+            self._flushing = keys
+            records, deleted = [], []
+            for key in keys:
+                state, data, updated_at = self._records[key]
+                if state is None and not data:
+                    deleted.append(self._db_key(key))
+                else:
+                    records.append((self._db_key(key), state, json.dumps(data, ensure_ascii=False), int(updated_at)))
+            try:
+                await save_fsm_records(records, deleted)
+            except BaseException:
+                # Записи закреплены на время записи, поэтому все ключи ещё в кэше
+                self._dirty |= keys
+                raise
+            finally:
+                self._flushing = set()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка записи состояний FSM: {e}", exc_info=True)
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get(key)
+        await self._put(key, state.state if isinstance(state, State) else state, record[1])
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get(key)
+        await self._put(key, record[0], data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get(key))[1].copy()
+
+    async def get_value(
+        self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None
+    ) -> Optional[Any]:
+        data = (await self._get(storage_key))[1]
+        return copy(data.get(dict_key, default))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._records), "dirty": len(self._dirty)}
+
+
+fsm_storage = SQLiteStorage()
+register_collector(lambda: [
+    (f"bot_fsm_{name}", value, "Хранилище состояний FSM")
+    for name, value in fsm_storage.stats().items()
+])
@@ -1,15 +1,28 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.filters import Command, CommandStart, CommandObject
 from aiogram.enums import ParseMode, ContentType
 from keyboards import *
 from database import *
 from config import ADMIN_ID
-from datetime import datetime
+from notifications import admin_notifier, MESSAGE_LIMIT
+from broadcast import broadcaster
+from rendering import edit_message
+from utils import fan_out
+from middlewares import setup_metrics, setup_throttling
+from metrics import get_summaries
+from slot_service import availability_cache, check_slot_availability
+from user_state import user_bookings
+from slot_calendar import set_day_schedule, parse_slot_range, scheduled_slots, today, normalize_time
+from datetime import datetime, timedelta
+from export import export_appointments, FORMATS
+import os
 import pytz
 import logging
 router = Router()
 logger = logging.getLogger(__name__)
+setup_metrics(router)
+setup_throttling(router)
 
 # ========== Основные команды ==========
 @router.message(CommandStart())
@@ -29,26 +42,41 @@ async def cmd_help(message: Message):
     
     if message.from_user.id == ADMIN_ID:
         help_text += "\n👑 Админ-команды:\n"
-        help_text += "/block <дата> <время> [причина] - Заблокировать слот\n"
-        help_text += "/unblock <дата> <время> - Разблокировать слот\n"
+        help_text += "/block <дата|дата..дата> <время|all> [дни недели] [причина] - Заблокировать слоты\n"
+        help_text += "/unblock <дата|дата..дата> <время|all> [дни недели] - Разблокировать слоты\n"
         help_text += "/blocked - Показать заблокированные слоты\n"
+        help_text += "/hours <дата> <время,время|off|default> - Расписание на дату\n"
+        help_text += "/export [с] [по] [csv|json] - Выгрузка записей\n"
+        help_text += "/broadcast <текст|stop> - Рассылка всем, кто записывался\n"
+        help_text += "/report [week|month|year|дата..дата] - Отчёт о загрузке\n"
+        help_text += "/stats - Время обработки и нагрузка на БД\n"
     
     await message.answer(help_text)
 
 # ========== Система записи ==========
 @router.callback_query(F.data == "week_appointments")
 async def week_appointments(callback: CallbackQuery):
-    await delete_expired_appointments()
-    await callback.message.edit_text(
+    await edit_message(
+        callback.message,
         "Выберите день недели:",
         reply_markup=await days_keyboard()
     )
 
+@router.callback_query(F.data.startswith("weekpage_"))
+async def week_page(callback: CallbackQuery):
+    week = int(callback.data.split("_")[1])
+    await edit_message(
+        callback.message,
+        "Выберите день недели:",
+        reply_markup=await days_keyboard(week)
+    )
+
 @router.callback_query(F.data.startswith("day_"))
 async def select_day(callback: CallbackQuery):
     date = callback.data.split("_")[1]
     day_name = datetime.strptime(date, '%Y-%m-%d').strftime('%A')
-    await callback.message.edit_text(
+    await edit_message(
+        callback.message,
         f"Выберите время для {day_name}:",
         reply_markup=await times_keyboard(date, day_name)
     )
@@ -56,7 +84,7 @@ async def select_day(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("appoint_"))
 async def make_appointment(callback: CallbackQuery):
     user_id = callback.from_user.id
-    existing = await get_user_appointment(user_id)
+    existing = await user_bookings.get(user_id)
     if existing:
         await callback.answer(
             f"❌ У вас уже есть запись на {existing[1]} в {existing[2]}",
@@ -67,11 +95,7 @@ async def make_appointment(callback: CallbackQuery):
     _, date, time = callback.data.split('_')
     day_name = datetime.strptime(date, '%Y-%m-%d').strftime('%A')
     
-    if not await is_slot_available(date, time):
-        await callback.answer("Это время уже занято!", show_alert=True)
-        return
-        
-    await add_appointment(
+    result = await book_slot(
         user_id=user_id,
         username=callback.from_user.username,
         full_name=callback.from_user.full_name,
@@ -79,18 +103,19 @@ async def make_appointment(callback: CallbackQuery):
         day=day_name,
         time=time
     )
-    
-    await callback.message.answer(
-        f"✅ Вы записаны на консультацию:\n"
-        f"📅 {day_name}, {date}\n"
-        f"⏰ {time}\n\n"
-        f"Для отмены используйте /cancel",
-        reply_markup=await main_menu(user_id)
-    )
+    if result.status == BookingStatus.ALREADY_BOOKED:
+        existing = result.appointment
+        await callback.answer(
+            f"❌ У вас уже есть запись на {existing[1]} в {existing[2]}",
+            show_alert=True
+        )
+        return
+    if result.status != BookingStatus.BOOKED:
+        await callback.answer("Это время уже занято!", show_alert=True)
+        return
     
     if ADMIN_ID:
-        await callback.bot.send_message(
-            ADMIN_ID,
+        admin_notifier.notify(
             f"📌 Новая запись:\n"
             f"👤 {callback.from_user.full_name} (@{callback.from_user.username})\n"
             f"📅 {day_name}, {date}\n"
@@ -98,41 +123,85 @@ async def make_appointment(callback: CallbackQuery):
             f"🆔 {user_id}"
         )
     
-    await callback.message.edit_reply_markup(
-        reply_markup=await times_keyboard(date, day_name)
+    async def refresh_times():
+        await edit_message(
+            callback.message,
+            reply_markup=await times_keyboard(date, day_name)
+        )
+    
+    # Подтверждение и обновление списка слотов друг от друга не зависят
+    await fan_out(
+        callback.message.answer(
+            f"✅ Вы записаны на консультацию:\n"
+            f"📅 {day_name}, {date}\n"
+            f"⏰ {time}\n\n"
+            f"Для отмены используйте /cancel",
+            reply_markup=await main_menu(user_id)
+        ),
+        refresh_times(),
     )
 
+@router.callback_query(F.data.startswith("wait_"))
+async def join_waitlist(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    if await user_bookings.get(user_id):
+        await callback.answer("❌ У вас уже есть запись", show_alert=True)
+        return
+    
+    _, date, time = callback.data.split('_')
+    if await check_slot_availability(date, time):
+        await callback.answer("✅ Это время уже свободно - можно записаться", show_alert=True)
+        return
+    
+    if await add_to_waitlist(user_id, date, time):
+        await callback.answer(f"🔔 Сообщим, если {date} в {time} освободится", show_alert=True)
+    else:
+        await callback.answer("Вы уже в листе ожидания на это время", show_alert=True)
+
 # ========== Отмена записи ==========
 @router.message(Command("cancel"))
 @router.callback_query(F.data == "cancel_booking")
 async def cancel_booking(update: Message | CallbackQuery):
     user_id = update.from_user.id
+    calls = []
     if isinstance(update, CallbackQuery):
         message = update.message
-        await update.answer()
+        calls.append(update.answer())
     else:
         message = update
     
-    appointment = await get_user_appointment(user_id)
+    appointment = await user_bookings.get(user_id)
     if not appointment:
-        await message.answer("❌ У вас нет активных записей")
+        await fan_out(*calls, message.answer("❌ У вас нет активных записей"))
         return
     
     await cancel_appointment(user_id)
-    await message.answer(
-        f"❌ Запись на {appointment[1]} в {appointment[2]} отменена",
-        reply_markup=await main_menu(user_id)
-    )
-    
     if ADMIN_ID:
-        await message.bot.send_message(
-            ADMIN_ID,
+        admin_notifier.notify(
             f"❌ Отмена записи:\n"
             f"👤 {update.from_user.full_name}\n"
             f"🆔 {user_id}"
         )
+    
+    await fan_out(*calls, message.answer(
+        f"❌ Запись на {appointment[1]} в {appointment[2]} отменена",
+        reply_markup=await main_menu(user_id)
+    ))
 
 # ========== Админ-команды ==========
+BLOCK_USAGE = (
+    "Использование: /block <дата|дата..дата> <время[,время]|all> [дни недели] [причина]\n"
+    "Пример: /block 2023-12-25 15:00 Праздник\n"
+    "Пример: /block 2023-12-25..2024-01-08 all Отпуск\n"
+    "Пример: /block 2023-12-01..2023-12-31 all сб,вс"
+)
+
+UNBLOCK_USAGE = (
+    "Использование: /unblock <дата|дата..дата> <время[,время]|all> [дни недели]\n"
+    "Пример: /unblock 2023-12-25 15:00\n"
+    "Пример: /unblock 2023-12-25..2024-01-08 all"
+)
+
 @router.message(Command("block"))
 async def block_slot_command(message: Message, command: CommandObject):
     if message.from_user.id != ADMIN_ID:
@@ -140,26 +209,44 @@ async def block_slot_command(message: Message, command: CommandObject):
         return
     
     if not command.args:
-        await message.answer("Использование: /block <дата> <время> [причина]\nПример: /block 2023-12-25 15:00 Праздник")
+        await message.answer(BLOCK_USAGE)
         return
     
-    args = command.args.split()
-    if len(args) < 2:
-        await message.answer("Нужно указать дату и время")
+    try:
+        dates, times, rest = parse_slot_range(command.args.split())
+    except ValueError as e:
+        await message.answer(str(e))
         return
+    reason = " ".join(rest) if rest else None
     
-    date, time = args[0], args[1]
-    reason = " ".join(args[2:]) if len(args) > 2 else None
-    
-    try:
-        datetime.strptime(date, '%Y-%m-%d')
-        datetime.strptime(time, '%H:%M')
-    except ValueError:
-        await message.answer("Неверный формат даты или времени. Используйте YYYY-MM-DD и HH:MM")
+    if times is None:
+        # all - все слоты дат по расписанию
+        slots = await scheduled_slots(
+            datetime.strptime(dates[0], '%Y-%m-%d').date(),
+            datetime.strptime(dates[-1], '%Y-%m-%d').date()
+        ) if dates else []
+        wanted = set(dates)
+        slots = [slot for slot in slots if slot[0] in wanted]
+    else:
+        slots = [(date, time) for date in dates for time in times]
+    if not slots:
+        await message.answer("В указанном диапазоне нет слотов")
         return
     
-    await block_slot(date, time, message.from_user.id, reason)
-    await message.answer(f"✅ Слот {date} {time} заблокирован\nПричина: {reason or 'не указана'}")
+    conflicts = await block_slots(slots, message.from_user.id, reason)
+    if len(slots) == 1:
+        text = f"✅ Слот {slots[0][0]} {slots[0][1]} заблокирован\n"
+    else:
+        text = f"✅ Заблокировано слотов: {len(slots)} ({slots[0][0]} - {slots[-1][0]})\n"
+    text += f"Причина: {reason or 'не указана'}"
+    
+    if conflicts:
+        text += f"\n\n⚠️ На заблокированное время есть записи ({len(conflicts)}):\n"
+        for date, time, user_id, full_name in conflicts[:30]:
+            text += f"📅 {date} ⏰ {time} - {full_name or 'без имени'} (🆔 {user_id})\n"
+        if len(conflicts) > 30:
+            text += f"... и ещё {len(conflicts) - 30}\n"
+    await message.answer(text)
 
 @router.message(Command("unblock"))
 async def unblock_slot_command(message: Message, command: CommandObject):
@@ -168,18 +255,80 @@ async def unblock_slot_command(message: Message, command: CommandObject):
         return
     
     if not command.args:
-        await message.answer("Использование: /unblock <дата> <время>\nПример: /unblock 2023-12-25 15:00")
+        await message.answer(UNBLOCK_USAGE)
+        return
+    
+    try:
+        dates, times, _ = parse_slot_range(command.args.split())
+    except ValueError as e:
+        await message.answer(str(e))
+        return
+    
+    removed = await unblock_slots(dates, times)
+    if not removed:
+        await message.answer("В указанном диапазоне нет заблокированных слотов")
+    elif len(removed) == 1:
+        await message.answer(f"✅ Слот {removed[0][0]} {removed[0][1]} разблокирован")
+    else:
+        await message.answer(f"✅ Разблокировано слотов: {len(removed)} ({removed[0][0]} - {removed[-1][0]})")
+
+@router.message(Command("hours"))
+async def day_hours_command(message: Message, command: CommandObject):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ Эта команда только для администратора")
+        return
+    
+    args = (command.args or "").split()
+    if len(args) != 2:
+        await message.answer(
+            "Использование: /hours <дата> <время,время|off|default>\n"
+            "Пример: /hours 2023-12-25 11:00,14:00\n"
+            "off - выходной, default - вернуть недельный шаблон"
+        )
         return
     
-    args = command.args.split()
-    if len(args) < 2:
-        await message.answer("Нужно указать дату и время")
+    date, spec = args
+    try:
+        date = datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m-%d')
+        times = (None if spec == "default" else [] if spec == "off"
+                 else sorted({normalize_time(time) for time in spec.split(",")}))
+    except ValueError:
+        await message.answer("Неверный формат даты или времени. Используйте YYYY-MM-DD и HH:MM")
         return
     
-    date, time = args[0], args[1]
+    await set_day_schedule(date, times)
+    if times is None:
+        await message.answer(f"✅ {date}: расписание по недельному шаблону")
+    elif not times:
+        await message.answer(f"✅ {date}: выходной")
+    else:
+        await message.answer(f"✅ {date}: приём в {', '.join(times)}")
+
+async def render_blocked_page(after: tuple = None, before: tuple = None):
+    """Текст и клавиатура страницы будущих блокировок"""
+    date_from = today().strftime('%Y-%m-%d')
+    slots, has_more = await get_blocked_slots(date_from, after=after, before=before)
+    if not slots:
+        return None, None
+    
+    lines = ["🛑 Заблокированные слоты:\n"]
+    # Длина причины не ограничена: делим лимит сообщения между строками страницы,
+    # 80 символов на дату, время и администратора
+    reason_limit = max((MESSAGE_LIMIT - 100) // len(slots) - 80, 20)
+    for date, time, reason, blocked_by in slots:
+        reason = reason or 'не указана'
+        if len(reason) > reason_limit:
+            reason = reason[:reason_limit - 1] + "…"
+        lines.append(f"📅 {date} ⏰ {time}")
+        lines.append(f"Причина: {reason}")
+        lines.append(f"Заблокировал: {blocked_by}\n")
     
-    await unblock_slot(date, time)
-    await message.answer(f"✅ Слот {date} {time} разблокирован")
+    if before is not None:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+    keyboard = blocked_page_keyboard(slots[0][:2], slots[-1][:2], has_prev, has_next)
+    return "\n".join(lines)[:MESSAGE_LIMIT], keyboard
 
 @router.message(Command("blocked"))
 async def list_blocked_slots(message: Message):
@@ -187,23 +336,178 @@ async def list_blocked_slots(message: Message):
         await message.answer("❌ Эта команда только для администратора")
         return
     
-    slots = await get_blocked_slots()
-    if not slots:
+    text, keyboard = await render_blocked_page()
+    if text is None:
         await message.answer("Нет заблокированных слотов")
         return
     
-    text = "🛑 Заблокированные слоты:\n\n"
-    for slot in slots:
-        text += f"📅 {slot[0]} ⏰ {slot[1]}\n"
-        text += f"Причина: {slot[2] or 'не указана'}\n"
-        text += f"Заблокировал: {slot[3]}\n\n"
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data.startswith("blocked_"))
+async def blocked_page(callback: CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("❌ Только для администратора", show_alert=True)
+        return
     
-    await message.answer(text)
+    _, direction, date, time = callback.data.split("_")
+    if direction == "next":
+        text, keyboard = await render_blocked_page(after=(date, time))
+    else:
+        text, keyboard = await render_blocked_page(before=(date, time))
+    if text is None:
+        await callback.answer("Больше заблокированных слотов нет")
+        return
+    
+    await callback.answer()
+    await edit_message(callback.message, text, reply_markup=keyboard)
+
+@router.message(Command("export"))
+async def export_command(message: Message, command: CommandObject):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ Эта команда только для администратора")
+        return
+    
+    args = (command.args or "").split()
+    fmt = "csv"
+    if args and args[-1] in FORMATS:
+        fmt = args.pop()
+    date_from = args[0] if len(args) > 0 else "0000-01-01"
+    date_to = args[1] if len(args) > 1 else "9999-12-31"
+    try:
+        for date in args[:2]:
+            datetime.strptime(date, '%Y-%m-%d')
+    except ValueError:
+        await message.answer(
+            "Использование: /export [с] [по] [csv|json]\n"
+            "Пример: /export 2023-01-01 2023-12-31 csv"
+        )
+        return
+    
+    path, count = await export_appointments(date_from, date_to, fmt)
+    try:
+        if not count:
+            await message.answer("За указанный период записей нет")
+            return
+        await message.answer_document(
+            FSInputFile(path, filename=f"appointments{os.path.splitext(path)[1]}"),
+            caption=f"📤 Записей: {count}"
+        )
+    finally:
+        os.remove(path)
+
+BROADCAST_USAGE = (
+    "Использование: /broadcast <текст> - разослать всем, кто записывался\n"
+    "/broadcast stop - остановить текущую рассылку"
+)
+
+@router.message(Command("broadcast"))
+async def broadcast_command(message: Message, command: CommandObject):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ Эта команда только для администратора")
+        return
+    
+    text = (command.args or "").strip()
+    if not text:
+        progress = broadcaster.progress
+        if broadcaster.running:
+            await message.answer(
+                f"📣 Рассылка #{progress['id']}: отправлено {progress['sent'] + progress['failed']} "
+                f"из {progress['total']}, ошибок {progress['failed']}\n\n{BROADCAST_USAGE}"
+            )
+        else:
+            await message.answer(BROADCAST_USAGE)
+        return
+    
+    if text == "stop":
+        if await broadcaster.cancel():
+            await message.answer("⏹ Рассылка остановлена")
+        else:
+            await message.answer("Активной рассылки нет")
+        return
+    
+    progress = await broadcaster.begin(text, message.from_user.id)
+    if progress is None:
+        await message.answer("⏳ Предыдущая рассылка ещё идёт. Остановить: /broadcast stop")
+        return
+    await message.answer(f"📣 Рассылка #{progress['id']} запущена, получателей: {progress['total']}")
+
+REPORT_PERIODS = {"week": 7, "month": 30, "year": 365}
+REPORT_USAGE = (
+    "Использование: /report [week|month|year|дата|дата..дата]\n"
+    "По умолчанию - последние 30 дней. Пример: /report 2023-01-01..2023-03-31"
+)
+
+@router.message(Command("report"))
+async def report_command(message: Message, command: CommandObject):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ Эта команда только для администратора")
+        return
+    
+    period = (command.args or "month").strip().lower()
+    if period in REPORT_PERIODS:
+        last = today()
+        first = last - timedelta(days=REPORT_PERIODS[period] - 1)
+    else:
+        first_spec, _, last_spec = period.partition("..")
+        try:
+            first = datetime.strptime(first_spec, '%Y-%m-%d').date()
+            last = datetime.strptime(last_spec or first_spec, '%Y-%m-%d').date()
+        except ValueError:
+            await message.answer(REPORT_USAGE)
+            return
+        if last < first:
+            await message.answer("Конец периода раньше начала")
+            return
+    
+    # Отчёт читает только сводку daily_stats: на каждый день - по строке на время слота
+    rows = await get_daily_stats(first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d'))
+    if not rows:
+        await message.answer("За указанный период данных нет")
+        return
+    
+    bookings, cancellations, blocks, available, filled = (sum(column) for column in list(zip(*rows))[1:])
+    text = (
+        f"📈 Отчёт за {first:%Y-%m-%d} - {last:%Y-%m-%d}\n\n"
+        f"✅ Записей: {bookings}\n"
+        f"❌ Отмен: {cancellations}\n"
+        f"🚫 Заблокировано слотов: {blocks}\n"
+        f"📊 Заполненность: {filled} из {available} ({filled / available if available else 0:.0%})\n\n"
+        f"⏰ По времени:\n"
+    )
+    for time, time_bookings, time_cancellations, _, time_available, time_filled in rows:
+        fill_rate = time_filled / time_available if time_available else 0
+        text += f"{time}: {fill_rate:.0%} ({time_filled}/{time_available}), записей {time_bookings}, отмен {time_cancellations}\n"
+    await message.answer(text[:4096])
+
+@router.message(Command("stats"))
+async def stats_command(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ Эта команда только для администратора")
+        return
+    
+    durations = get_summaries("bot_handler_seconds")
+    queries = get_summaries("bot_handler_db_queries")
+    if not durations:
+        await message.answer("Статистика пока пуста")
+        return
+    
+    text = "📊 Обработчики (p50 / p95 / p99, мс):\n\n"
+    for name, summary in sorted(durations.items(), key=lambda item: -item[1].count):
+        p50, p95, p99 = (summary.quantile(q) * 1000 for q in (0.5, 0.95, 0.99))
+        db = queries.get(name)
+        avg_queries = db.total / db.count if db and db.count else 0
+        text += f"{name}: {p50:.0f} / {p95:.0f} / {p99:.0f}\n"
+        text += f"   вызовов {summary.count}, запросов к БД {avg_queries:.1f} на событие\n"
+    
+    cache = availability_cache.stats()
+    text += f"\n🗂 Кэш слотов: попаданий {cache['hits']}, промахов {cache['misses']}, {cache['hit_rate']:.0%}"
+    await message.answer(text[:4096])
 
 # ========== Информация ==========
 @router.callback_query(F.data == "about_me")
 async def about_me(callback: CallbackQuery):
-    await callback.message.edit_text(
+    await edit_message(
+        callback.message,
         "ℹ️ <b>Обо мне:</b>\n\n"
         "Мой таплинк https://taplink.cc/psereality\n\n"
         "📞 Контакты: @psy_birdy",
@@ -213,7 +517,8 @@ async def about_me(callback: CallbackQuery):
 
 @router.callback_query(F.data == "support_author")
 async def support_author(callback: CallbackQuery):
-    await callback.message.edit_text(
+    await edit_message(
+        callback.message,
         "💖 <b>Поддержать автора:</b>\n\n"
         "карта сбер: <code>2202202345909851</code>\n",
         parse_mode=ParseMode.HTML,
@@ -223,15 +528,16 @@ async def support_author(callback: CallbackQuery):
 # ========== Навигация ==========
 @router.callback_query(F.data == "back_to_main")
 async def back_main(callback: CallbackQuery):
-    await callback.message.edit_text(
+    await edit_message(
+        callback.message,
         "Главное меню:",
         reply_markup=await main_menu(callback.from_user.id)
     )
 
 @router.callback_query(F.data == "back_to_days")
 async def back_days(callback: CallbackQuery):
-    await delete_expired_appointments()
-    await callback.message.edit_text(
+    await edit_message(
+        callback.message,
         "Выберите день недели:",
         reply_markup=await days_keyboard()
     )
@@ -1,82 +1,123 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from datetime import datetime, timedelta
-import pytz
-from config import TIMEZONE
-from database import is_slot_available
+from config import BOOKING_HORIZON_WEEKS
+from database import SLOT_FREE
+from slot_service import get_availability
+from slot_calendar import DAY_NAMES, today, week_dates, week_of
+from user_state import user_bookings
 
-def get_week_days():
-    tz = pytz.timezone(TIMEZONE)
-    today = datetime.now(tz)
-    current_weekday = today.weekday()  # 0-понедельник, 6-воскресенье
-    
+def get_week_days(week: int = 0):
+    current = today()
     days = []
-    day_names = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота"]
-    
-    # Начинаем с сегодняшнего дня или ближайшего понедельника
-    start_date = today - timedelta(days=current_weekday)
-    
-    for i in range(6):  # Понедельник-Суббота
-        day_date = (start_date + timedelta(days=i)).strftime('%Y-%m-%d')
-        day_name = day_names[i]
+    # Только даты недели, которые ещё не прошли и входят в горизонт записи
+    for day in week_dates(week):
+        day_name = DAY_NAMES[day.weekday()]
         
         # Если день сегодняшний, добавляем пометку
-        if i == current_weekday:
+        if day == current:
             day_name += " (сегодня)"
-        # Если день прошел, пропускаем
-        elif (start_date + timedelta(days=i)).date() < today.date():
-            continue
             
         days.append({
             "name": day_name,
-            "date": day_date
+            "date": day.strftime('%Y-%m-%d')
         })
     
     return days
 
+def _build(layout: tuple) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=text, callback_data=callback) for text, callback in row]
+        for row in layout
+    ])
+
+# Клавиатуры, зависящие от слотов: ключ -> (раскладка, клавиатура).
+# Сбрасываются при смене даты, пока дата та же - пересобираются только при изменении раскладки
+_memo = {}
+_memo_date = None
+
+def _memoized(key, layout: tuple) -> InlineKeyboardMarkup:
+    global _memo_date
+    current = today()
+    if current != _memo_date:
+        _memo.clear()
+        _memo_date = current
+    entry = _memo.get(key)
+    if entry is not None and entry[0] == layout:
+        return entry[1]
+    markup = _build(layout)
+    _memo[key] = (layout, markup)
+    return markup
+
+_MAIN_MENU_LAYOUT = (
+    (("📅 Записи на неделе", "week_appointments"),),
+    (("ℹ️ Обо мне", "about_me"),),
+    (("💖 Поддержать автора", "support_author"),),
+)
+# Статические клавиатуры собираются один раз
+_MAIN_MENU = _build(_MAIN_MENU_LAYOUT)
+_MAIN_MENU_WITH_CANCEL = _build(_MAIN_MENU_LAYOUT + ((("❌ Отменить запись", "cancel_booking"),),))
+_BACK_TO_MAIN = _build(((("🔙 На главную", "back_to_main"),),))
+
 async def main_menu(user_id: int):
-    from database import get_user_appointment
-    has_appointment = await get_user_appointment(user_id)
-    buttons = [
-        [InlineKeyboardButton(text="📅 Записи на неделе", callback_data="week_appointments")],
-        [InlineKeyboardButton(text="ℹ️ Обо мне", callback_data="about_me")],
-        [InlineKeyboardButton(text="💖 Поддержать автора", callback_data="support_author")]
-    ]
-    if has_appointment:
-        buttons.append([InlineKeyboardButton(text="❌ Отменить запись", callback_data="cancel_booking")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    has_appointment = await user_bookings.get(user_id)
+    return _MAIN_MENU_WITH_CANCEL if has_appointment else _MAIN_MENU
 
-async def days_keyboard():
-    days = get_week_days()
+async def days_keyboard(week: int = 0):
+    days = get_week_days(week)
+    availability = await get_availability(days[0]["date"], days[-1]["date"]) if days else {}
     keyboard = []
     for day in days:
-        keyboard.append([InlineKeyboardButton(
-            text=day["name"], 
-            callback_data=f"day_{day['date']}"
-        )])
-    keyboard.append([InlineKeyboardButton(text="🔙 На главную", callback_data="back_to_main")])
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+        slots = availability.get(day["date"], {})
+        # Дни без слотов по расписанию не показываем
+        if not slots:
+            continue
+        text = day["name"]
+        # Полностью занятые дни помечаем сразу в списке
+        if SLOT_FREE not in slots.values():
+            text += " ❌"
+        keyboard.append(((text, f"day_{day['date']}"),))
+    
+    if not keyboard:
+        keyboard.append((("Нет доступных дней", "no_slots"),))
+    
+    navigation = []
+    if week > 0:
+        navigation.append(("◀️ Неделя", f"weekpage_{week - 1}"))
+    if week < BOOKING_HORIZON_WEEKS - 1:
+        navigation.append(("Неделя ▶️", f"weekpage_{week + 1}"))
+    if navigation:
+        keyboard.append(tuple(navigation))
+    keyboard.append((("🔙 На главную", "back_to_main"),))
+    return _memoized(("days", week), tuple(keyboard))
 
 async def times_keyboard(date: str, day_name: str):
-    times = ["13:00", "15:00", "17:00", "19:00"]
+    availability = await get_availability(date, date)
     keyboard = []
     
-    for time in times:
-        is_available = await is_slot_available(date, time)
-        if is_available:
-            text = f"{time} ✅"
-            callback = f"appoint_{date}_{time}"
-            keyboard.append([InlineKeyboardButton(text=text, callback_data=callback)])
+    for time, status in availability[date].items():
+        if status == SLOT_FREE:
+            keyboard.append(((f"{time} ✅", f"appoint_{date}_{time}"),))
     
     if not keyboard:
-        keyboard.append([InlineKeyboardButton(text="Нет доступных слотов", callback_data="no_slots")])
+        # День занят целиком: можно встать в очередь на любое время
+        for time in availability[date]:
+            keyboard.append(((f"🔔 {time} - сообщить, если освободится", f"wait_{date}_{time}"),))
+    if not keyboard:
+        keyboard.append((("Нет доступных слотов", "no_slots"),))
     
-    keyboard.append([
-        InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_days"),
-        InlineKeyboardButton(text="На главную", callback_data="back_to_main")
-    ])
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    keyboard.append((
+        ("🔙 Назад", f"weekpage_{max(week_of(date), 0)}"),
+        ("На главную", "back_to_main"),
+    ))
+    return _memoized(("times", date), tuple(keyboard))
 
 def back_to_main():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 На главную", callback_data="back_to_main")]
-    ])
\ No newline at end of file
+    return _BACK_TO_MAIN
+
+def blocked_page_keyboard(first: tuple, last: tuple, has_prev: bool, has_next: bool):
+    """Листание /blocked: в callback_data ключ (date, time) крайней строки страницы"""
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"blocked_prev_{first[0]}_{first[1]}"))
+    if has_next:
+        row.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"blocked_next_{last[0]}_{last[1]}"))
+    return InlineKeyboardMarkup(inline_keyboard=[row] if row else [])
\ No newline at end of file
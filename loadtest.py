@@ -0,0 +1,477 @@
+"""Сквозная нагрузочная проверка бота с локальной заменой Bot API.
+
+Бот собирается так же, как в main.py, получает обновления через getUpdates
+от локального aiohttp-сервера и отвечает ему же. Синтетические пользователи
+проходят сценарий /start -> неделя -> день -> запись -> /cancel.
+Всё работает без сети на временной БД.
+
+Пример:
+    python loadtest.py --users 2000 --concurrency 200 --api-latency 30
+    python loadtest.py --users 500 --retry-after-rate 0.02 --output load.json
+"""
+import os
+
+# Настройки бота читаются при импорте config - задаём их до импорта модулей бота
+os.environ.setdefault("BOT_TOKEN", "123456:LOADTEST")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("METRICS_PORT", "0")
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import NamedTuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from aiohttp import web
+
+import database
+from config import THROTTLE_RATE
+from bench_database import git_revision
+
+TEXT_REPLIES = ("sendMessage",)
+SCREEN_REPLIES = ("editMessageText", "answerCallbackQuery")
+BOOK_REPLIES = ("sendMessage", "answerCallbackQuery")
+FIRST_USER_ID = 100000
+
+
+class Call(NamedTuple):
+    method: str
+    params: dict
+    result: object
+
+
+class FakeBotAPI:
+    """Локальная замена Bot API: обновления из очереди, вызовы бота раскладываются по чатам"""
+
+    def __init__(self, latency: float = 0.0, retry_after_rate: float = 0.0, retry_after: int = 1, seed: int = 0):
+        self.latency = latency
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.updates = asyncio.Queue()
+        self.calls = defaultdict(asyncio.Queue)  # chat_id -> Call
+        self.counts = Counter()
+        self.retry_after_injected = 0
+        self._update_id = 0
+        self._message_id = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def push(self, update: dict):
+        self._update_id += 1
+        update["update_id"] = self._update_id
+        self.updates.put_nowait(update)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.counts[method] += 1
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "getMe":
+            return self._ok({"id": 1, "is_bot": True, "first_name": "Load", "username": "loadtest_bot"})
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.retry_after_rate and self.rng.random() < self.retry_after_rate:
+            self.retry_after_injected += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        result = self._result(method, params)
+        chat_id = self._chat_of(method, params)
+        if chat_id is not None:
+            self.calls[chat_id].put_nowait(Call(method, params, result))
+        return self._ok(result)
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> web.Response:
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout) if timeout else self.updates.get_nowait()
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            return self._ok([])
+        batch = [first]
+        while len(batch) < limit and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return self._ok(batch)
+
+    @staticmethod
+    def _chat_of(method: str, params: dict):
+        if method == "answerCallbackQuery":
+            # id запроса генератор собирает как "<chat_id>:<номер>"
+            return int(params["callback_query_id"].split(":")[0])
+        if "chat_id" in params:
+            return int(params["chat_id"])
+        return None
+
+    def _result(self, method: str, params: dict):
+        if method not in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            return True
+        if method == "sendMessage":
+            self._message_id += 1
+            message_id = self._message_id
+        else:
+            message_id = int(params["message_id"])
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "text": params.get("text", ""),
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        return message
+
+
+def buttons(message: dict) -> list:
+    """[(текст, callback_data)] кнопок сообщения"""
+    markup = message.get("reply_markup") or {}
+    return [(button["text"], button.get("callback_data", ""))
+            for row in markup.get("inline_keyboard", []) for button in row]
+
+
+class LoadReport:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # шаг -> секунды
+        self.outcomes = Counter()
+        self.violations = []
+        self.holders = {}  # слот -> пользователь с подтверждённой записью
+
+    def step_stats(self) -> dict:
+        result = {}
+        for step, values in self.latencies.items():
+            values = sorted(values)
+
+            def pct(q):
+                return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+            result[step] = {
+                "calls": len(values),
+                "mean_ms": statistics.fmean(values) * 1000,
+                "p50_ms": pct(0.5),
+                "p95_ms": pct(0.95),
+                "p99_ms": pct(0.99),
+                "max_ms": values[-1] * 1000,
+            }
+        return result
+
+
+class SyntheticUser:
+    """Один пользователь, проходящий сценарий записи и отмены"""
+
+    def __init__(self, user_id: int, api: FakeBotAPI, report: LoadReport, rng: random.Random,
+                 step_timeout: float, think: float):
+        self.user_id = user_id
+        self.api = api
+        self.report = report
+        self.rng = rng
+        self.step_timeout = step_timeout
+        self.think = think
+        # Шаги не чаще ограничения бота: отброшенное сообщение без ответа выглядело бы таймаутом
+        self.min_interval = 1 / THROTTLE_RATE if THROTTLE_RATE > 0 else 0
+        self._next_send = 0.0
+        self._callbacks = 0
+
+    def _user(self) -> dict:
+        return {"id": self.user_id, "is_bot": False, "first_name": f"User {self.user_id}",
+                "username": f"user{self.user_id}"}
+
+    def _message(self, text: str) -> dict:
+        return {"message": {
+            "message_id": 1, "date": int(time.time()), "text": text,
+            "chat": {"id": self.user_id, "type": "private"}, "from": self._user(),
+        }}
+
+    def _callback(self, data: str, message_id: int) -> dict:
+        self._callbacks += 1
+        return {"callback_query": {
+            "id": f"{self.user_id}:{self._callbacks}", "chat_instance": str(self.user_id),
+            "data": data, "from": self._user(),
+            "message": {"message_id": message_id, "date": int(time.time()), "text": "",
+                        "chat": {"id": self.user_id, "type": "private"}},
+        }}
+
+    async def _step(self, name: str, update: dict, expect: tuple) -> Call | None:
+        """Отправка обновления и ожидание ответа бота одним из методов expect"""
+        calls = self.api.calls[self.user_id]
+        # Побочные вызовы прошлого шага (например, обновление клавиатуры) не в счёт
+        while not calls.empty():
+            calls.get_nowait()
+        # Ожидание своей очереди не входит в задержку шага
+        delay = self._next_send - time.monotonic()
+        if delay > 0:
+            self.report.outcomes["paced"] += 1
+            await asyncio.sleep(delay)
+        self._next_send = time.monotonic() + self.min_interval
+        start = time.perf_counter()
+        self.api.push(update)
+        try:
+            while True:
+                call = await asyncio.wait_for(calls.get(), self.step_timeout)
+                if call.method in expect:
+                    break
+        except asyncio.TimeoutError:
+            self.report.outcomes[f"{name}_timeout"] += 1
+            return None
+        self.report.latencies[name].append(time.perf_counter() - start)
+        return call
+
+    async def _pause(self):
+        if self.think:
+            await asyncio.sleep(self.rng.uniform(0, self.think))
+
+    async def run(self):
+        await self._pause()
+        call = await self._step("start", self._message("/start"), TEXT_REPLIES)
+        if call is None:
+            return
+        message_id = call.result["message_id"]
+
+        # Листаем недели вперёд, пока не найдётся день со свободным временем
+        data = "week_appointments"
+        while True:
+            await self._pause()
+            call = await self._step("week", self._callback(data, message_id), SCREEN_REPLIES)
+            if call is None or call.method != "editMessageText":
+                self.report.outcomes["throttled" if call else "aborted"] += 1
+                return
+            screen = buttons(call.result)
+            days = [data for text, data in screen if data.startswith("day_") and "❌" not in text]
+            if days:
+                break
+            forward = [data for text, data in screen if data.startswith("weekpage_") and "▶️" in text]
+            if not forward:
+                self.report.outcomes["no_free_days"] += 1
+                return
+            data = forward[0]
+
+        await self._pause()
+        call = await self._step("day", self._callback(self.rng.choice(days), message_id), SCREEN_REPLIES)
+        if call is None or call.method != "editMessageText":
+            self.report.outcomes["throttled" if call else "aborted"] += 1
+            return
+        times = [data for _, data in buttons(call.result) if data.startswith("appoint_")]
+        if not times:
+            self.report.outcomes["no_free_times"] += 1
+            return
+
+        slot = self.rng.choice(times)
+        await self._pause()
+        call = await self._step("book", self._callback(slot, message_id), BOOK_REPLIES)
+        if call is None:
+            return
+        if call.method != "sendMessage" or not call.params.get("text", "").startswith("✅"):
+            self.report.outcomes["slot_taken"] += 1
+            return
+
+        self.report.outcomes["booked"] += 1
+        holder = self.report.holders.get(slot)
+        if holder is not None:
+            self.report.violations.append(f"{slot}: подтверждено {holder} и {self.user_id} одновременно")
+        self.report.holders[slot] = self.user_id
+        await self._pause()
+        # Слот освобождается с момента запроса отмены: дальше его может занять другой
+        if self.report.holders.get(slot) == self.user_id:
+            del self.report.holders[slot]
+        call = await self._step("cancel", self._message("/cancel"), TEXT_REPLIES)
+        if call is not None:
+            self.report.outcomes["cancelled"] += 1
+
+
+def check_database(path: str) -> list:
+    """Нарушения целостности записей после прогона"""
+    db = sqlite3.connect(path)
+    violations = []
+    for date, time_, count in db.execute('''
+        SELECT date, time, COUNT(*) FROM appointments GROUP BY date, time HAVING COUNT(*) > 1
+    '''):
+        violations.append(f"{date} {time_}: {count} записей на один слот")
+    for user_id, count in db.execute('''
+        SELECT user_id, COUNT(*) FROM appointments GROUP BY user_id HAVING COUNT(*) > 1
+    '''):
+        violations.append(f"пользователь {user_id}: {count} активных записей")
+    for date, time_ in db.execute('''
+        SELECT a.date, a.time FROM appointments a
+        LEFT JOIN slots s ON s.date = a.date AND s.time = a.time
+        WHERE s.status IS NOT ?
+    ''', (database.SLOT_BOOKED,)):
+        violations.append(f"{date} {time_}: запись есть, слот не отмечен занятым")
+    for date, time_ in db.execute('''
+        SELECT s.date, s.time FROM slots s
+        WHERE s.status = ? AND NOT EXISTS (
+            SELECT 1 FROM appointments a WHERE a.date = s.date AND a.time = s.time
+        )
+    ''', (database.SLOT_BOOKED,)):
+        violations.append(f"{date} {time_}: слот занят без записи")
+    db.close()
+    return violations
+
+
+async def run(args) -> dict:
+    # Модули бота импортируются после выбора временной БД
+    from handlers import router
+    from slot_calendar import materialize
+    from user_state import user_bookings
+    from notifications import admin_notifier
+    from reminders import reminder_scheduler
+    from waitlist import waitlist_notifier
+    from fsm_storage import fsm_storage
+    from middlewares import ApiMetricsMiddleware
+    from metrics import render_prometheus
+
+    api = FakeBotAPI(args.api_latency / 1000, args.retry_after_rate, args.retry_after, args.seed)
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    await database.init_db()
+    await materialize()
+    await user_bookings.warm()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}"), limit=args.connections)
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session,
+              default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot.session.middleware(ApiMetricsMiddleware())
+    dp = Dispatcher(storage=fsm_storage)
+    dp.include_router(router)
+    await admin_notifier.start(bot)
+    await reminder_scheduler.start(bot)
+    await waitlist_notifier.start(bot)
+    polling = asyncio.create_task(dp.start_polling(bot, polling_timeout=1, handle_signals=False,
+                                                   close_bot_session=False))
+
+    report = LoadReport()
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def journey(index: int):
+        user = SyntheticUser(FIRST_USER_ID + index, api, report, random.Random(rng.random()),
+                             args.step_timeout, args.think / 1000)
+        async with semaphore:
+            await user.run()
+
+    print(f"Пользователей: {args.users}, одновременно: {args.concurrency}, "
+          f"задержка API: {args.api_latency} мс, доля RetryAfter: {args.retry_after_rate}")
+    start = time.perf_counter()
+    await asyncio.gather(*(journey(i) for i in range(args.users)))
+    wall = time.perf_counter() - start
+
+    await dp.stop_polling()
+    await asyncio.gather(polling, return_exceptions=True)
+    await waitlist_notifier.stop()
+    await reminder_scheduler.stop()
+    await admin_notifier.stop()
+    await fsm_storage.close()
+    await bot.session.close()
+    await database.close_db()
+    await runner.cleanup()
+
+    # Счётчики ограничения частоты берём из выгрузки метрик бота
+    throttling = {}
+    for line in render_prometheus().splitlines():
+        if line.startswith("bot_throttling_"):
+            name, value = line.split()
+            throttling[name.removeprefix("bot_throttling_")] = float(value)
+
+    steps = sum(len(values) for values in report.latencies.values())
+    violations = report.violations + check_database(database.DB_NAME)
+    return {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "wall_seconds": wall,
+        "updates_per_sec": steps / wall if wall else 0.0,
+        "journeys_per_sec": args.users / wall if wall else 0.0,
+        "steps": report.step_stats(),
+        "outcomes": dict(report.outcomes),
+        "api_calls": dict(api.counts),
+        "retry_after_injected": api.retry_after_injected,
+        "throttling": throttling,
+        "violations": violations,
+    }
+
+
+def print_report(result: dict):
+    print(f"\nВремя: {result['wall_seconds']:.1f} с; "
+          f"{result['updates_per_sec']:.0f} обновлений/с, {result['journeys_per_sec']:.1f} сценариев/с")
+    for step in ("start", "week", "day", "book", "cancel"):
+        stats = result["steps"].get(step)
+        if stats:
+            print(f"  {step:<7} n={stats['calls']:<6} p50={stats['p50_ms']:.1f}мс "
+                  f"p95={stats['p95_ms']:.1f}мс p99={stats['p99_ms']:.1f}мс max={stats['max_ms']:.1f}мс")
+    print("Исходы: " + ", ".join(f"{name}={count}" for name, count in sorted(result["outcomes"].items())))
+    print(f"Вызовы API: {result['api_calls']}; RetryAfter подставлено: {result['retry_after_injected']}")
+    print(f"Ограничение частоты в боте: {result['throttling']}")
+    if result["violations"]:
+        print(f"❌ Нарушения записи ({len(result['violations'])}):")
+        for violation in result["violations"][:20]:
+            print(f"  {violation}")
+    else:
+        print("✅ Нарушений записи нет")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="Синтетических пользователей")
+    parser.add_argument("--concurrency", type=int, default=100, help="Одновременно проходящих сценарий")
+    parser.add_argument("--api-latency", type=float, default=20, help="Задержка ответа Bot API, мс")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="Доля запросов с ответом 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответе 429, сек")
+    parser.add_argument("--think", type=float, default=500,
+                        help="Пауза пользователя перед шагом, до N мс; шаги в любом случае не чаще THROTTLE_RATE")
+    parser.add_argument("--step-timeout", type=float, default=15, help="Ожидание ответа на шаг, сек")
+    parser.add_argument("--connections", type=int, default=100, help="Соединений сессии бота с API")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Файл для результатов в JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database.DB_NAME = os.path.join(workdir, "loadtest.db")
+        result = await run(args)
+
+    print_report(result)
+    if args.output:
+        report = {
+            "meta": {
+                "revision": git_revision(),
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "api_latency_ms": args.api_latency,
+                "retry_after_rate": args.retry_after_rate,
+            },
+            "result": result,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны в {args.output}")
+    if result["violations"]:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
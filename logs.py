@@ -0,0 +1,133 @@
+import json
+import logging
+import queue
+import random
+import sys
+from copy import copy
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config import (
+    LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUPS,
+    LOG_QUEUE_SIZE, LOG_DEBUG_SAMPLE,
+)
+from metrics import current_update, register_collector
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class ContextFilter(logging.Filter):
+    """Метки текущего обновления (update_id, user_id, обработчик) на каждой записи"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        stats = current_update.get()
+        record.update_id = stats.update_id if stats else None
+        record.user_id = stats.user_id if stats else None
+        record.handler = stats.handler if stats else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только долю rate записей уровня DEBUG, остальные уровни - все"""
+
+    def __init__(self, rate: float = LOG_DEBUG_SAMPLE):
+        super().__init__()
+        self.rate = rate
+        self.skipped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or random.random() < self.rate:
+            return True
+        self.skipped += 1
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который при заполненной очереди отбрасывает запись, а не ждёт"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # В потоке цикла событий только подставляем аргументы; форматирование - в потоке записи.
+        # Трассировку сохраняем текстом: объект исключения держит кадры стека живыми
+        record = copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON с метками обновления"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("update_id", "user_id", "handler"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_queue_handler: DroppingQueueHandler | None = None
+_sampling: SamplingFilter | None = None
+
+
+def setup_logging() -> QueueListener:
+    """Логирование через очередь: цикл событий только кладёт запись, пишет отдельный поток.
+
+    Возвращает запущенный QueueListener; при остановке бота вызовите stop(),
+    чтобы дописать оставшиеся в очереди записи.
+    """
+    global _queue_handler, _sampling
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if LOG_FILE:
+        handlers.append(RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _sampling = SamplingFilter()
+    _queue_handler.addFilter(_sampling)
+    _queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL.upper())
+
+    listener = QueueListener(_queue_handler.queue, *handlers)
+    listener.start()
+    return listener
+
+
+register_collector(lambda: [
+    ("bot_log_dropped_total", _queue_handler.dropped if _queue_handler else 0,
+     "Записей лога, отброшенных при переполненной очереди"),
+    ("bot_log_sampled_out_total", _sampling.skipped if _sampling else 0,
+     "DEBUG-записей, не прошедших выборку"),
+    ("bot_log_queue_size", _queue_handler.queue.qsize() if _queue_handler else 0,
+     "Записей лога в очереди"),
+])
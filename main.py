@@ -3,15 +3,26 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from config import BOT_TOKEN, ADMIN_ID
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from config import (
+    BOT_TOKEN, ADMIN_ID, BOT_MODE, METRICS_HOST, METRICS_PORT,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+)
 from handlers import router
-from database import init_db
+from database import init_db, close_db
+from maintenance import run_maintenance
+from slot_calendar import materialize
+from notifications import admin_notifier
+from reminders import reminder_scheduler
+from broadcast import broadcaster
+from waitlist import waitlist_notifier
+from fsm_storage import fsm_storage
+from user_state import user_bookings
+from metrics import start_metrics_server
+from middlewares import ApiMetricsMiddleware
+from logs import setup_logging
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-)
 logger = logging.getLogger(__name__)
 
 async def on_startup(bot: Bot):
@@ -23,27 +34,86 @@ async def on_startup(bot: Bot):
     if ADMIN_ID:
         await bot.send_message(ADMIN_ID, "🤖 Бот успешно запущен")
 
+async def on_webhook_startup(bot: Bot):
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or None,
+        )
+        logger.info(f"Вебхук установлен: {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Приём обновлений через aiohttp; обработка идёт в фоне, ответ Telegram уходит сразу"""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET or None,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    dp.startup.register(on_webhook_startup)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Вебхук-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 async def main():
     try:
         await init_db()
+        await materialize()
+        await user_bookings.warm()
+        maintenance_task = asyncio.create_task(run_maintenance())
         
         bot = Bot(
             token=BOT_TOKEN,
             default=DefaultBotProperties(parse_mode=ParseMode.HTML)
         )
-        dp = Dispatcher()
+        bot.session.middleware(ApiMetricsMiddleware())
+        if METRICS_PORT:
+            metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        dp = Dispatcher(storage=fsm_storage)
         dp.include_router(router)
+        await admin_notifier.start(bot)
+        await reminder_scheduler.start(bot)
+        await broadcaster.start(bot)
+        await waitlist_notifier.start(bot)
         
         dp.startup.register(on_startup)
-        logger.info("Запускаем бота...")
-        await dp.start_polling(bot)
+        logger.info(f"Запускаем бота в режиме {BOT_MODE}...")
+        if BOT_MODE == 'webhook':
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
         
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}", exc_info=True)
     finally:
+        if 'maintenance_task' in locals():
+            maintenance_task.cancel()
+            await asyncio.gather(maintenance_task, return_exceptions=True)
+        if 'metrics_runner' in locals():
+            await metrics_runner.cleanup()
         if 'bot' in locals():
+            await waitlist_notifier.stop()
+            await broadcaster.stop()
+            await reminder_scheduler.stop()
+            await admin_notifier.stop()
             await bot.session.close()
             logger.info("Бот остановлен")
+        await fsm_storage.close()
+        await close_db()
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    log_listener = setup_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        # Дописываем записи, оставшиеся в очереди
+        log_listener.stop()
\ No newline at end of file
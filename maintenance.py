@@ -0,0 +1,29 @@
+import asyncio
+import logging
+import time
+from config import SWEEP_INTERVAL, FSM_STATE_TTL
+from database import delete_expired_appointments, archive_past_blocks, prune_waitlist, delete_expired_fsm_records
+from slot_calendar import materialize, today
+
+logger = logging.getLogger(__name__)
+
+
+async def run_maintenance(interval: int = SWEEP_INTERVAL):
+    """Периодическое обслуживание БД вне обработчиков: архивы прошедших записей и блокировок, лист ожидания, состояния FSM, календарь слотов"""
+    while True:
+        try:
+            archived = await delete_expired_appointments()
+            if archived:
+                logger.info(f"Перенесено в архив прошедших записей: {archived}")
+            blocks = await archive_past_blocks(today().strftime('%Y-%m-%d'))
+            if blocks:
+                logger.info(f"Перенесено в архив прошедших блокировок: {blocks}")
+            await prune_waitlist(today().strftime('%Y-%m-%d'))
+            await delete_expired_fsm_records(int(time.time()) - FSM_STATE_TTL)
+            # Сдвигает горизонт записи при смене даты
+            await materialize()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка фонового обслуживания БД: {e}", exc_info=True)
+        await asyncio.sleep(interval)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextvars import Context, ContextVar
+from functools import wraps
+from aiohttp import web
+from config import METRICS_WINDOW
+
+logger = logging.getLogger(__name__)
+
+
+class Summary:
+    """Скользящее окно последних значений для квантилей и накопленные count/sum"""
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class UpdateStats:
+    """Затраты одного обновления: время БД и Bot API по вызовам"""
+
+    def __init__(self, update_id: int | None = None, user_id: int | None = None):
+        self.update_id = update_id
+        self.user_id = user_id
+        self.handler = "unhandled"
+        self.db_queries = []  # (имя функции, секунды)
+        self.api_calls = []  # (метод, секунды)
+
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_summaries = {}  # (метрика, (метки)) -> Summary
+_help = {}
+_collectors = []
+
+current_update: ContextVar[UpdateStats | None] = ContextVar("current_update", default=None)
+
+
+def observe(name: str, value: float, help_text: str = "", **labels):
+    key = (name, tuple(sorted(labels.items())))
+    summary = _summaries.get(key)
+    if summary is None:
+        summary = _summaries[key] = Summary()
+        _help.setdefault(name, help_text)
+    summary.observe(value)
+
+
+def get_summaries(name: str) -> dict:
+    """Сводки метрики по набору меток"""
+    return {dict(labels).get("handler", ""): summary
+            for (metric, labels), summary in _summaries.items() if metric == name}
+
+
+def register_collector(collector):
+    """collector() -> [(имя, значение, help)] - значения, снимаемые в момент выгрузки"""
+    _collectors.append(collector)
+
+
+def background_task(coro) -> asyncio.Task:
+    """Фоновая задача в пустом контексте: её запросы не попадут в статистику обновления, из которого она запущена"""
+    return asyncio.create_task(coro, context=Context())
+
+
+def record_db_query(name: str, seconds: float):
+    observe("bot_db_query_seconds", seconds, "Длительность функций database.py", query=name)
+    stats = current_update.get()
+    if stats is not None:
+        stats.db_queries.append((name, seconds))
+
+
+def record_api_call(method: str, seconds: float):
+    observe("bot_api_call_seconds", seconds, "Длительность запросов к Bot API", method=method)
+    stats = current_update.get()
+    if stats is not None:
+        stats.api_calls.append((method, seconds))
+
+
+def timed_query(func):
+    """Декоратор для функций database.py: время и количество запросов"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            record_db_query(func.__name__, time.perf_counter() - start)
+    return wrapper
+
+
+def _format_labels(labels: tuple, **extra) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def render_prometheus() -> str:
+    """Выгрузка в текстовом формате Prometheus"""
+    lines = []
+    described = set()
+    for (name, labels), summary in sorted(_summaries.items()):
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {name} {_help.get(name, '')}")
+            lines.append(f"# TYPE {name} summary")
+        for q in QUANTILES:
+            lines.append(f"{name}{_format_labels(labels, quantile=q)} {summary.quantile(q)}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {summary.total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {summary.count}")
+    for collector in _collectors:
+        for name, value, help_text in collector():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Небольшой локальный HTTP-сервер с /metrics"""
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,173 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject, CallbackQuery
+from config import SLOW_UPDATE_THRESHOLD, THROTTLE_RATE, THROTTLE_BURST, THROTTLE_EVICT_INTERVAL
+from metrics import UpdateStats, current_update, observe, record_api_call, register_collector
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware: время обработки, запросы к БД и Bot API на каждое событие"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        update, user = data.get("event_update"), data.get("event_from_user")
+        stats = UpdateStats(update.update_id if update else None, user.id if user else None)
+        token = current_update.set(stats)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - start
+            # Записываем до сброса контекста: предупреждение получит метки обновления
+            self._record(stats, elapsed)
+            current_update.reset(token)
+
+    @staticmethod
+    def _record(stats: UpdateStats, elapsed: float):
+        name = stats.handler
+        db_time = sum(seconds for _, seconds in stats.db_queries)
+        api_time = sum(seconds for _, seconds in stats.api_calls)
+        observe("bot_handler_seconds", elapsed, "Полное время обработки события", handler=name)
+        observe("bot_handler_db_queries", len(stats.db_queries), "Запросов к БД на событие", handler=name)
+        observe("bot_handler_db_seconds", db_time, "Время в БД на событие", handler=name)
+        observe("bot_handler_api_calls", len(stats.api_calls), "Вызовов Bot API на событие", handler=name)
+        observe("bot_handler_api_seconds", api_time, "Время в Bot API на событие", handler=name)
+
+        if elapsed * 1000 >= SLOW_UPDATE_THRESHOLD:
+            queries = ", ".join(f"{query} {seconds * 1000:.1f}мс" for query, seconds in stats.db_queries)
+            calls = ", ".join(f"{method} {seconds * 1000:.1f}мс" for method, seconds in stats.api_calls)
+            logger.warning(
+                f"Медленная обработка {name}: {elapsed * 1000:.1f}мс; "
+                f"БД {db_time * 1000:.1f}мс [{queries}]; API {api_time * 1000:.1f}мс [{calls}]"
+            )
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Внутренний middleware: подписывает статистику именем выбранного обработчика"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        stats = current_update.get()
+        if stats is not None and "handler" in data:
+            stats.handler = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время каждого запроса к Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            record_api_call(type(method).__name__, time.perf_counter() - start)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Внешний middleware: token bucket на пользователя и один обработчик на одинаковый callback"""
+
+    def __init__(self, rate: float = THROTTLE_RATE, burst: int = THROTTLE_BURST,
+                 evict_interval: float = THROTTLE_EVICT_INTERVAL):
+        self.rate = rate
+        self.burst = burst
+        self.evict_interval = evict_interval
+        self.throttled = 0
+        self.coalesced = 0
+        self._buckets = {}  # user_id -> (токены, время пополнения)
+        self._inflight = set()  # (user_id, callback.data) ещё в обработке
+        self._evicted_at = time.monotonic()
+
+    def _allow(self, user_id: int, now: float) -> bool:
+        tokens, updated_at = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            return False
+        self._buckets[user_id] = (tokens - 1, now)
+        return True
+
+    def _evict(self, now: float):
+        # Полная корзина ничем не отличается от отсутствующей - такие записи удаляем
+        full_after = self.burst / self.rate if self.rate > 0 else float("inf")
+        self._buckets = {
+            user_id: bucket for user_id, bucket in self._buckets.items()
+            if now - bucket[1] < full_after
+        }
+        self._evicted_at = now
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        key = None
+        if isinstance(event, CallbackQuery):
+            key = (user.id, event.data)
+            if key in self._inflight:
+                # Повторное нажатие, пока первое ещё обрабатывается
+                self.coalesced += 1
+                await event.answer()
+                return None
+
+        now = time.monotonic()
+        if now - self._evicted_at >= self.evict_interval:
+            self._evict(now)
+        if not self._allow(user.id, now):
+            self.throttled += 1
+            if isinstance(event, CallbackQuery):
+                await event.answer("⏳ Слишком часто, подождите немного")
+            return None
+
+        if key is None:
+            return await handler(event, data)
+        self._inflight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._inflight.discard(key)
+
+    def stats(self) -> dict:
+        return {
+            "throttled": self.throttled,
+            "coalesced": self.coalesced,
+            "users": len(self._buckets),
+            "inflight": len(self._inflight),
+        }
+
+
+def setup_throttling(router) -> ThrottlingMiddleware:
+    throttling = ThrottlingMiddleware()
+    for observer in (router.message, router.callback_query):
+        observer.outer_middleware(throttling)
+    register_collector(lambda: [
+        (f"bot_throttling_{name}", value, "Ограничение частоты действий пользователей")
+        for name, value in throttling.stats().items()
+    ])
+    return throttling
+
+
+def setup_metrics(router):
+    metrics_middleware = UpdateMetricsMiddleware()
+    name_middleware = HandlerNameMiddleware()
+    for observer in (router.message, router.callback_query):
+        observer.outer_middleware(metrics_middleware)
+        observer.middleware(name_middleware)
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError, TelegramAPIError
+from config import (
+    ADMIN_ID, NOTIFY_QUEUE_SIZE, NOTIFY_DIGEST_THRESHOLD, NOTIFY_DIGEST_WINDOW, NOTIFY_MAX_RETRIES,
+)
+from database import save_pending_notifications, take_pending_notifications
+from metrics import background_task
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+
+
+class AdminNotifier:
+    """Фоновая отправка уведомлений администратору со сводками при всплесках"""
+
+    def __init__(self, chat_id: int = ADMIN_ID, maxsize: int = NOTIFY_QUEUE_SIZE,
+                 digest_threshold: int = NOTIFY_DIGEST_THRESHOLD, digest_window: float = NOTIFY_DIGEST_WINDOW,
+                 max_retries: int = NOTIFY_MAX_RETRIES):
+        self.chat_id = chat_id
+        self.digest_threshold = digest_threshold
+        self.digest_window = digest_window
+        self.max_retries = max_retries
+        self._queue = asyncio.Queue(maxsize)
+        self._recent = deque()  # Время поступления событий в текущем окне
+        self._pending = []  # Взятые из очереди, но ещё не отправленные
+        self._bot = None
+        self._task = None
+        self._saving = set()  # Задачи сохранения переполнения в БД
+
+    def notify(self, text: str):
+        """Постановка в очередь без ожидания отправки"""
+        if not self.chat_id:
+            return
+        try:
+            self._queue.put_nowait(text)
+        except asyncio.QueueFull:
+            # Не теряем событие: откладываем в БД до следующего запуска
+            logger.warning("Очередь уведомлений переполнена, событие сохранено в БД")
+            task = background_task(save_pending_notifications(self.chat_id, [text]))
+            self._saving.add(task)
+            task.add_done_callback(self._saved)
+
+    def _saved(self, task: asyncio.Task):
+        self._saving.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Уведомление не сохранено в БД: {task.exception()}")
+
+    async def start(self, bot: Bot):
+        self._bot = bot
+        if not self.chat_id:
+            return
+        for text in await take_pending_notifications(self.chat_id):
+            self.notify(text)
+        self._task = background_task(self._run())
+
+    async def stop(self):
+        """Остановка отправителя и сохранение неотправленного в БД"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Переполнение, сохраняемое в фоне, должно попасть в БД до её закрытия
+        await asyncio.gather(*self._saving, return_exceptions=True)
+        texts = self._pending
+        self._pending = []
+        while not self._queue.empty():
+            texts.append(self._queue.get_nowait())
+        if texts:
+            await save_pending_notifications(self.chat_id, texts)
+            logger.info(f"Сохранено неотправленных уведомлений: {len(texts)}")
+
+    def _take(self, text: str):
+        self._pending.append(text)
+        self._recent.append(time.monotonic())
+
+    def _drain(self):
+        while not self._queue.empty():
+            self._take(self._queue.get_nowait())
+
+    def _is_burst(self) -> bool:
+        cutoff = time.monotonic() - self.digest_window
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+        return len(self._recent) > self.digest_threshold
+
+    async def _run(self):
+        while True:
+            self._take(await self._queue.get())
+            self._drain()
+            if self._is_burst():
+                # Всплеск: копим события до конца окна и отправляем одной сводкой
+                await asyncio.sleep(self.digest_window)
+                self._drain()
+                await self._send_digest(self._pending)
+            else:
+                while self._pending:
+                    await self._send(self._pending[0])
+                    self._pending.pop(0)
+            self._pending = []
+
+    async def _send_digest(self, texts: list):
+        header = f"📋 Сводка событий ({len(texts)}):\n\n"
+        chunk = header
+        for text in texts:
+            block = text + "\n\n"
+            if len(chunk) + len(block) > MESSAGE_LIMIT:
+                await self._send(chunk.rstrip())
+                chunk = ""
+            chunk += block
+        if chunk.strip():
+            await self._send(chunk.rstrip())
+
+    async def _send(self, text: str):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._bot.send_message(self.chat_id, text[:MESSAGE_LIMIT])
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Ограничение Telegram, ждём {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                delay = min(2 ** attempt, 60)
+                logger.warning(f"Сбой отправки уведомления ({e}), повтор через {delay} с")
+                await asyncio.sleep(delay)
+            except TelegramAPIError as e:
+                logger.error(f"Уведомление администратору не отправлено: {e}")
+                return
+        logger.error("Уведомление администратору не отправлено: исчерпаны повторы")
+
+
+admin_notifier = AdminNotifier()
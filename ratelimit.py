@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Ограничение частоты: acquire() ждёт, пока в корзине не появится токен"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Под замком ожидающие получают токены по очереди
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatThrottle:
+    """Минимальный интервал между сообщениями в один чат"""
+
+    def __init__(self, interval: float, maxsize: int = 1024):
+        self.interval = interval
+        self.maxsize = maxsize
+        self._ready_at = {}  # chat_id -> время, раньше которого писать в чат нельзя
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        ready_at = self._ready_at.get(chat_id, now)
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+        self._ready_at[chat_id] = max(ready_at, now) + self.interval
+        if len(self._ready_at) > self.maxsize:
+            # Прошедшие ограничения ничего не значат - удаляем их
+            self._ready_at = {chat: at for chat, at in self._ready_at.items() if at > now}
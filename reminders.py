@@ -0,0 +1,146 @@
+import asyncio
+import heapq
+import logging
+import time as clock
+from datetime import datetime
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramAPIError
+import database
+from config import REMINDER_LEAD, REMINDER_WINDOW, REMINDER_RATE
+from metrics import background_task
+from ratelimit import TokenBucket
+from slot_calendar import DAY_NAMES
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 3
+
+
+class ReminderScheduler:
+    """Напоминания клиентам за REMINDER_LEAD до начала записи.
+
+    В памяти только ближайшее окно REMINDER_WINDOW: min-heap
+    (время напоминания, user_id, date, day, time). Дальние записи подгружаются
+    из БД по мере сдвига окна. Отменённые записи не удаляются из кучи, а
+    пропускаются при извлечении - актуальный слот пользователя хранится в _scheduled.
+    """
+
+    def __init__(self, lead: int = REMINDER_LEAD, window: int = REMINDER_WINDOW, rate: float = REMINDER_RATE):
+        self.lead = lead
+        self.window = window
+        self.sent = 0
+        self._heap = []
+        self._scheduled = {}  # user_id -> (date, time) ожидающего напоминания
+        self._loaded_until = 0  # starts_at, до которого записи из БД уже в куче
+        self._queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._bucket = TokenBucket(rate)
+        self._bot = None
+        self._tasks = []
+
+    async def start(self, bot: Bot):
+        self._bot = bot
+        # После перезапуска берём всё неотправленное, что ещё не началось
+        self._loaded_until = int(clock.time())
+        self._tasks = [background_task(self._run()), background_task(self._worker())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _push(self, user_id: int, date: str, day: str, time: str, starts_at: int):
+        self._scheduled[user_id] = (date, time)
+        heapq.heappush(self._heap, (starts_at - self.lead, user_id, date, day, time))
+
+    async def _load(self, now: float):
+        until = int(now) + self.lead + self.window
+        rows = await database.get_pending_reminders(self._loaded_until, until)
+        for row in rows:
+            self._push(*row)
+        self._loaded_until = until
+        if rows:
+            logger.info(f"Запланировано напоминаний: {len(rows)}")
+
+    async def _run(self):
+        while True:
+            now = clock.time()
+            # Подгружаем следующее окно, когда пройдена половина текущего
+            reload_at = self._loaded_until - self.lead - self.window / 2
+            if now >= reload_at:
+                try:
+                    await self._load(now)
+                except Exception as e:
+                    logger.error(f"Ошибка загрузки напоминаний: {e}", exc_info=True)
+                    await asyncio.sleep(60)
+                    continue
+                reload_at = self._loaded_until - self.lead - self.window / 2
+
+            while self._heap and self._heap[0][0] <= now:
+                _, user_id, date, day, time = heapq.heappop(self._heap)
+                if self._scheduled.get(user_id) == (date, time):
+                    del self._scheduled[user_id]
+                    self._queue.put_nowait((user_id, date, day, time))
+
+            wake_at = min(reload_at, self._heap[0][0]) if self._heap else reload_at
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(wake_at - clock.time(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            user_id, date, day, time = await self._queue.get()
+            try:
+                await self._bucket.acquire()
+                # Отметка до отправки: после перезапуска напоминание не уйдёт повторно
+                if not await database.claim_reminder(user_id, date, time):
+                    continue
+                await self._send(user_id, date, time)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка отправки напоминания {user_id}: {e}", exc_info=True)
+
+    async def _send(self, user_id: int, date: str, time: str):
+        day_name = DAY_NAMES[datetime.strptime(date, '%Y-%m-%d').weekday()]
+        text = (
+            f"⏰ Напоминание о консультации:\n"
+            f"📅 {day_name}, {date}\n"
+            f"⏰ {time}\n\n"
+            f"Для отмены используйте /cancel"
+        )
+        for _ in range(MAX_RETRIES):
+            try:
+                await self._bot.send_message(user_id, text)
+                self.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Ограничение Telegram, ждём {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+            except TelegramAPIError as e:
+                # Например, пользователь заблокировал бота
+                logger.warning(f"Напоминание {user_id} не отправлено: {e}")
+                return
+
+    def on_event(self, event: str, payload: dict):
+        user_id = payload.get("user_id")
+        if user_id is None:
+            return
+        if event == database.EVENT_BOOKED:
+            starts_at = database.slot_timestamp(payload["date"], payload["time"])
+            # Записи за пределами окна подгрузятся из БД при его сдвиге
+            if clock.time() < starts_at <= self._loaded_until:
+                self._push(user_id, payload["date"], payload["day"], payload["time"], starts_at)
+                self._wakeup.set()
+        elif event in (database.EVENT_CANCELLED, database.EVENT_EXPIRED):
+            self._scheduled.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._scheduled)
+
+
+reminder_scheduler = ReminderScheduler()
+database.subscribe(reminder_scheduler.on_event)
@@ -0,0 +1,82 @@
+import logging
+from collections import OrderedDict
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, InlineKeyboardMarkup
+from config import EDIT_FINGERPRINT_SIZE
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+
+class MessageFingerprints:
+    """Последнее отправленное содержимое сообщений бота: (chat_id, message_id) -> (текст, клавиатура).
+
+    Повторное нажатие той же кнопки даёт правку без изменений; такие правки
+    не отправляются в Bot API вовсе.
+    """
+
+    def __init__(self, maxsize: int = EDIT_FINGERPRINT_SIZE):
+        self.maxsize = maxsize
+        self.sent = 0
+        self.skipped = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _markup(reply_markup: InlineKeyboardMarkup | None):
+        return hash(reply_markup.model_dump_json(exclude_none=True)) if reply_markup else None
+
+    def get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, fingerprint: tuple):
+        self._entries[key] = fingerprint
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def edit(self, message: Message, text: str | None = None,
+                   reply_markup: InlineKeyboardMarkup | None = None, **kwargs) -> bool:
+        """Правка текста и клавиатуры (или только клавиатуры при text=None); False - изменений не было"""
+        key = (message.chat.id, message.message_id)
+        previous = self.get(key)
+        markup = self._markup(reply_markup)
+        if text is None:
+            fingerprint = (previous[0] if previous else None, markup)
+        else:
+            fingerprint = (hash((text, kwargs.get("parse_mode"))), markup)
+        if fingerprint == previous:
+            self.skipped += 1
+            return False
+
+        try:
+            if text is None:
+                await message.edit_reply_markup(reply_markup=reply_markup)
+            else:
+                await message.edit_text(text, reply_markup=reply_markup, **kwargs)
+        except TelegramBadRequest as e:
+            # Содержимое совпало с тем, что мы не запомнили (например, после перезапуска)
+            if "message is not modified" not in str(e):
+                raise
+            self.put(key, fingerprint)
+            return False
+        self.sent += 1
+        self.put(key, fingerprint)
+        return True
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "skipped": self.skipped, "size": len(self._entries)}
+
+
+message_fingerprints = MessageFingerprints()
+register_collector(lambda: [
+    (f"bot_message_edits_{name}", value, "Правки сообщений и пропущенные повторы")
+    for name, value in message_fingerprints.stats().items()
+])
+
+
+async def edit_message(message: Message, text: str | None = None,
+                       reply_markup: InlineKeyboardMarkup | None = None, **kwargs) -> bool:
+    return await message_fingerprints.edit(message, text, reply_markup, **kwargs)
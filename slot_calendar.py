@@ -0,0 +1,112 @@
+import logging
+from datetime import datetime, timedelta
+import pytz
+import database
+from config import TIMEZONE, SCHEDULE_TEMPLATE, BOOKING_HORIZON_WEEKS
+
+logger = logging.getLogger(__name__)
+
+DAY_NAMES = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+WEEKDAY_CODES = {
+    **{name: i for i, name in enumerate(["пн", "вт", "ср", "чт", "пт", "сб", "вс"])},
+    **{name: i for i, name in enumerate(["mon", "tue", "wed", "thu", "fri", "sat", "sun"])},
+}
+MAX_RANGE_DAYS = 366  # Предел диапазона в одной команде
+
+
+def today():
+    return datetime.now(pytz.timezone(TIMEZONE)).date()
+
+
+def horizon():
+    """Первая и последняя дата, открытые для записи: от сегодня до конца последней недели горизонта"""
+    start = today()
+    week_start = start - timedelta(days=start.weekday())
+    return start, week_start + timedelta(days=7 * BOOKING_HORIZON_WEEKS - 1)
+
+
+def week_of(date: str) -> int:
+    """Номер недели относительно текущей (0 - текущая)"""
+    day = datetime.strptime(date, '%Y-%m-%d').date()
+    current = today()
+    return ((day - timedelta(days=day.weekday())) - (current - timedelta(days=current.weekday()))).days // 7
+
+
+def week_dates(week: int = 0) -> list:
+    """Даты недели с номером week, попадающие в горизонт записи"""
+    first, last = horizon()
+    week_start = first - timedelta(days=first.weekday()) + timedelta(days=7 * week)
+    days = (week_start + timedelta(days=i) for i in range(7))
+    return [day for day in days if first <= day <= last]
+
+
+async def scheduled_slots(first, last) -> list:
+    """Слоты [(дата, время)] по шаблону и особому расписанию для дат first..last"""
+    overrides = await database.get_schedule_overrides(first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d'))
+    slots = []
+    for i in range((last - first).days + 1):
+        day = first + timedelta(days=i)
+        date = day.strftime('%Y-%m-%d')
+        times = overrides.get(date, SCHEDULE_TEMPLATE.get(day.weekday(), []))
+        slots.extend((date, time) for time in times)
+    return slots
+
+
+async def materialize():
+    """Пересборка slots на весь горизонт по шаблону и особому расписанию"""
+    first, last = horizon()
+    date_from, date_to = first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d')
+    desired = await scheduled_slots(first, last)
+    changed = await database.sync_slots(date_from, date_to, desired)
+    if changed:
+        logger.info(f"Календарь слотов обновлён: {len(changed)} дн. до {date_to}")
+    return changed
+
+
+def normalize_time(time: str) -> str:
+    """Время в виде HH:MM ('9:00' -> '09:00'), иначе ValueError.
+
+    strptime принимает и '9:00', но такая строка сортируется после '19:00'
+    и не совпадает с ключом слота '09:00'.
+    """
+    return datetime.strptime(time, '%H:%M').strftime('%H:%M')
+
+
+def parse_slot_range(args: list):
+    """Разбор '<дата|дата..дата> <время[,время]|all> [дни недели] ...'.
+
+    Возвращает (даты, времена или None для всех, оставшиеся аргументы).
+    Ошибки формата - ValueError с текстом для администратора.
+    """
+    if len(args) < 2:
+        raise ValueError("Нужно указать дату и время")
+    date_spec, time_spec, rest = args[0], args[1], list(args[2:])
+
+    first_spec, _, last_spec = date_spec.partition("..")
+    try:
+        first = datetime.strptime(first_spec, '%Y-%m-%d').date()
+        last = datetime.strptime(last_spec or first_spec, '%Y-%m-%d').date()
+        times = None if time_spec == "all" else sorted({normalize_time(time) for time in time_spec.split(",")})
+    except ValueError:
+        raise ValueError("Неверный формат даты или времени. Используйте YYYY-MM-DD и HH:MM")
+    if last < first:
+        raise ValueError("Конец диапазона раньше начала")
+    if (last - first).days > MAX_RANGE_DAYS:
+        raise ValueError(f"Диапазон больше {MAX_RANGE_DAYS} дней")
+
+    weekdays = None
+    if rest and all(name in WEEKDAY_CODES for name in rest[0].lower().split(",")):
+        weekdays = {WEEKDAY_CODES[name] for name in rest.pop(0).lower().split(",")}
+
+    dates = []
+    for i in range((last - first).days + 1):
+        day = first + timedelta(days=i)
+        if weekdays is None or day.weekday() in weekdays:
+            dates.append(day.strftime('%Y-%m-%d'))
+    return dates, times, rest
+
+
+async def set_day_schedule(date: str, times: list | None):
+    """Особое расписание на дату (пустой список - выходной, None - по шаблону)"""
+    await database.set_schedule_override(date, times)
+    await materialize()
@@ -1,16 +1,153 @@
-from functools import lru_cache
-from database import is_slot_available
+import asyncio
+import logging
+import time as monotonic_time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import database
+from metrics import register_collector
+from config import SLOT_CACHE_TTL, SLOT_CACHE_SIZE
 
-async def check_slot_availability(date: str, time: str) -> bool:
-    return await is_slot_available(date, time)
+logger = logging.getLogger(__name__)
+
+
+class AvailabilityCache:
+    """Кэш статусов слотов по датам с TTL и вытеснением LRU.
+
+    Набор времён у каждой даты свой (шаблон расписания), поэтому единица кэша -
+    день целиком: {время: статус}.
+    """
+
+    def __init__(self, ttl: float = SLOT_CACHE_TTL, maxsize: int = SLOT_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()  # date -> (statuses, expires_at)
+        self._inflight = {}  # date -> Future с матрицей дня
+        # Растёт при каждой инвалидации: результат чтения, начатого раньше, не кэшируется
+        self._epoch = 0
+
+    def _lookup(self, date: str, now: float):
+        entry = self._entries.get(date)
+        if entry is None or entry[1] < now:
+            return None
+        self._entries.move_to_end(date)
+        return entry[0]
+
+    def _store(self, matrix: dict):
+        expires_at = monotonic_time.monotonic() + self.ttl
+        for date, statuses in matrix.items():
+            self._entries[date] = (statuses, expires_at)
+            self._entries.move_to_end(date)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def _load(self, dates: list):
+        """Одно чтение из БД на все недостающие даты, результат раздаётся ожидающим"""
+        loop = asyncio.get_running_loop()
+        futures = {date: loop.create_future() for date in dates}
+        self._inflight.update(futures)
+        epoch = self._epoch
+        try:
+            matrix = await database.get_availability(min(dates), max(dates))
+        except asyncio.CancelledError:
+            # Чтение отменено вместе с вызывающим (таймаут, ушедший клиент) - ожидающие не должны висеть
+            for future in futures.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in futures.values():
+                future.set_exception(e)
+                # Исключение уже получит вызывающий, ожидающих может не быть
+                future.exception()
+            raise
+        finally:
+            for date in dates:
+                self._inflight.pop(date, None)
+        if epoch == self._epoch:
+            self._store(matrix)
+        for date, future in futures.items():
+            future.set_result(matrix[date])
+        return matrix
+
+    async def get_range(self, date_from: str, date_to: str) -> dict:
+        start = datetime.strptime(date_from, '%Y-%m-%d')
+        days = (datetime.strptime(date_to, '%Y-%m-%d') - start).days + 1
+        dates = [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(max(days, 0))]
+
+        now = monotonic_time.monotonic()
+        result, missing, waiting = {}, [], {}
+        for date in dates:
+            statuses = self._lookup(date, now)
+            if statuses is not None:
+                self.hits += 1
+                result[date] = statuses
+            elif date in self._inflight:
+                # Такой же промах уже читается из БД - ждём его
+                self.coalesced += 1
+                waiting[date] = self._inflight[date]
+            else:
+                self.misses += 1
+                missing.append(date)
+
+        if missing:
+            matrix = await self._load(missing)
+            for date in missing:
+                result[date] = matrix[date]
+        for date, future in waiting.items():
+            try:
+                result[date] = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Отменили чужое чтение, а не нас - читаем дату сами
+                result[date] = (await self._load([date]))[date]
+        return {date: dict(result[date]) for date in dates}
+
+    async def get_day(self, date: str) -> dict:
+        return (await self.get_range(date, date))[date]
+
+    async def is_available(self, date: str, time: str) -> bool:
+        return (await self.get_day(date)).get(time) == database.SLOT_FREE
+
+    def invalidate(self, date: str):
+        self._epoch += 1
+        self._entries.pop(date, None)
+
+    def clear(self):
+        self._epoch += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self._entries),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def on_event(self, event: str, payload: dict):
+        self.invalidate(payload["date"])
+
+
+availability_cache = AvailabilityCache()
+database.subscribe(availability_cache.on_event)
+register_collector(lambda: [
+    (f"bot_slot_cache_{name}", value, "Кэш доступности слотов")
+    for name, value in availability_cache.stats().items()
+])
+
+
+async def get_availability(date_from: str, date_to: str) -> dict:
+    return await availability_cache.get_range(date_from, date_to)
 
-@lru_cache(maxsize=100)
-async def check_slot_availability(date: str, time: str) -> bool:
-    return await is_slot_available(date, time)
 
 async def check_slot_availability(date: str, time: str) -> bool:
     try:
-        return await is_slot_available(date, time)
+        return await availability_cache.is_available(date, time)
     except Exception as e:
-        print(f"Error checking slot: {e}")
-        return False
\ No newline at end of file
+        logger.error(f"Ошибка проверки слота {date} {time}: {e}")
+        return False
@@ -0,0 +1,44 @@
+import logging
+import database
+
+logger = logging.getLogger(__name__)
+
+
+class UserBookingCache:
+    """Активные записи пользователей в памяти: user_id -> (date, day, time).
+
+    Хранятся только пользователи с активной записью, поэтому память ограничена
+    числом слотов, а не числом написавших боту. Источник истины - БД: кэш
+    прогревается из неё при старте и обновляется событиями после коммита.
+    """
+
+    def __init__(self):
+        self._bookings = {}
+        self._ready = False
+
+    async def warm(self):
+        rows = await database.get_active_appointments()
+        self._bookings = {user_id: (date, day, time) for user_id, date, day, time in rows}
+        self._ready = True
+        logger.info(f"Загружено активных записей пользователей: {len(self._bookings)}")
+
+    async def get(self, user_id: int):
+        if not self._ready:
+            return await database.get_user_appointment(user_id)
+        return self._bookings.get(user_id)
+
+    def on_event(self, event: str, payload: dict):
+        user_id = payload.get("user_id")
+        if user_id is None:
+            return
+        if event == database.EVENT_BOOKED:
+            self._bookings[user_id] = (payload["date"], payload["day"], payload["time"])
+        elif event in (database.EVENT_CANCELLED, database.EVENT_EXPIRED):
+            self._bookings.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._bookings)
+
+
+user_bookings = UserBookingCache()
+database.subscribe(user_bookings.on_event)
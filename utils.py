@@ -1,18 +1,24 @@
-from database import is_slot_available
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+import asyncio
+import logging
+from config import FANOUT_CONCURRENCY, FANOUT_TIMEOUT
 
-async def generate_times_keyboard(date, day_name):
-    times = ["13:00", "15:00", "17:00", "19:00"]
-    keyboard = []
-    
-    for time in times:
-        is_available = await is_slot_available(date, time)
-        text = f"{time} {'❌' if not is_available else '✅'}"
-        callback = "unavailable" if not is_available else f"appoint_{date}_{time}"
-        keyboard.append([InlineKeyboardButton(text=text, callback_data=callback)])
-    
-    keyboard.append([
-        InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_days"),
-        InlineKeyboardButton(text="На главную", callback_data="back_to_main")
-    ])
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+async def fan_out(*calls, limit: int = FANOUT_CONCURRENCY, timeout: float = FANOUT_TIMEOUT) -> list:
+    """Независимые вызовы одновременно, не больше limit сразу и не дольше timeout каждый.
+
+    Сбой одного вызова не мешает остальным: вместо результата в списке будет исключение.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(call):
+        async with semaphore:
+            return await asyncio.wait_for(call, timeout)
+
+    results = await asyncio.gather(*(run(call) for call in calls), return_exceptions=True)
+    for result in results:
+        if isinstance(result, asyncio.TimeoutError):
+            logger.warning(f"Запрос к Bot API не уложился в {timeout} с")
+        elif isinstance(result, Exception):
+            logger.error(f"Ошибка запроса к Bot API: {result}")
+    return results
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time as clock
+from datetime import datetime
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+import database
+from config import WAITLIST_HOLD
+from metrics import background_task
+from slot_calendar import DAY_NAMES
+from user_state import user_bookings
+
+logger = logging.getLogger(__name__)
+
+
+class WaitlistNotifier:
+    """Предложение освободившегося слота ожидающим по очереди.
+
+    После отмены или разблокировки слот придерживается в slots за первым в очереди
+    на WAITLIST_HOLD секунд: book_slot не отдаст его никому другому. Если за это
+    время он не записался, удержание переходит к следующему. Когда очередь
+    кончилась, удержание снимается и слот снова свободен для всех.
+    """
+
+    def __init__(self, hold: int = WAITLIST_HOLD):
+        self.hold = hold
+        self._bot = None
+        self._offers = {}  # (date, time) -> задача предложения слота
+
+    async def start(self, bot: Bot):
+        self._bot = bot
+
+    async def stop(self):
+        tasks = list(self._offers.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._bot = None
+
+    def on_event(self, event: str, payload: dict):
+        if event not in (database.EVENT_CANCELLED, database.EVENT_UNBLOCKED) or self._bot is None:
+            return
+        key = (payload["date"], payload["time"])
+        # По слоту идёт одна волна предложений, повторные события её не дублируют
+        if key not in self._offers:
+            self._offers[key] = background_task(self._offer(*key))
+
+    async def _offer(self, date: str, time: str):
+        try:
+            while database.slot_timestamp(date, time) > clock.time():
+                user_id = await database.pop_waitlist(date, time)
+                if user_id is None:
+                    break
+                # Записаться второй раз пользователь всё равно не сможет
+                if await user_bookings.get(user_id):
+                    continue
+                # Слот заняли или заблокировали - предлагать нечего
+                if not await database.hold_slot(date, time, user_id, int(clock.time() + self.hold)):
+                    break
+                if await self._send(user_id, date, time):
+                    await asyncio.sleep(self.hold)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка листа ожидания {date} {time}: {e}", exc_info=True)
+        finally:
+            self._offers.pop((date, time), None)
+            try:
+                await database.release_slot(date, time)
+            except Exception as e:
+                # При остановке БД может быть уже закрыта; удержание всё равно истечёт само
+                logger.warning(f"Удержание слота {date} {time} не снято: {e}")
+
+    async def _send(self, user_id: int, date: str, time: str) -> bool:
+        day_name = DAY_NAMES[datetime.strptime(date, '%Y-%m-%d').weekday()]
+        try:
+            await self._bot.send_message(
+                user_id,
+                f"🔔 Освободилось время:\n"
+                f"📅 {day_name}, {date}\n"
+                f"⏰ {time}\n\n"
+                f"Время придержано за вами на {max(int(self.hold) // 60, 1)} мин.",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="✅ Записаться", callback_data=f"appoint_{date}_{time}")]
+                ])
+            )
+            return True
+        except TelegramAPIError as e:
+            logger.warning(f"Предложение слота {user_id} не отправлено: {e}")
+            return False
+
+
+waitlist_notifier = WaitlistNotifier()
+database.subscribe(waitlist_notifier.on_event)